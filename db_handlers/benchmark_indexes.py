@@ -0,0 +1,110 @@
+"""Замер запросов к flight_trackers без индексов и с индексами из миграций.
+
+Запуск: python -m db_handlers.benchmark_indexes [строк] [доля_активных]
+По умолчанию 1 000 000 трекеров, активна 5% (отключённые строки копятся годами).
+Нужен только стандартный sqlite3; база создаётся во временном каталоге.
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from db_handlers.migrations import CREATE_USERS, CREATE_FLIGHT_TRACKERS, TRACKER_INDEXES
+
+USERS = 100_000
+AIRPORTS = ["SVO", "DME", "VKO", "LED", "KGD", "AER", "OVB", "SVX", "KZN", "IST",
+            "DXB", "AYT", "GOJ", "KRR", "UFA", "ROV", "MRV", "TJM", "IKT", "VVO"]
+
+# Те же запросы, что в db_handlers/db_class.py
+QUERIES = {
+    "get_active_trackers": (
+        """SELECT ft.id, u.telegram_id, ft.origin, ft.destination, ft.date, ft.price_limit, ft.last_sent_price
+           FROM flight_trackers ft JOIN users u ON ft.user_id = u.id WHERE ft.active = 1""",
+        lambda: (),
+    ),
+    "get_user_trackers": (
+        """SELECT id, origin, destination, date, price_limit
+           FROM flight_trackers WHERE user_id = ? AND active = 1""",
+        lambda: (random.randint(1, USERS),),
+    ),
+    "count_active_trackers": (
+        "SELECT COUNT(*) FROM flight_trackers WHERE user_id = ? AND active = 1",
+        lambda: (random.randint(1, USERS),),
+    ),
+    "tracker_exists": (
+        """SELECT 1 FROM flight_trackers
+           WHERE user_id = ? AND origin = ? AND destination = ? AND date = ? AND active = 1""",
+        lambda: (random.randint(1, USERS), random.choice(AIRPORTS), random.choice(AIRPORTS), _random_date()),
+    ),
+}
+
+
+def _random_date() -> str:
+    return f"2026-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}"
+
+
+def _fill(conn: sqlite3.Connection, rows: int, active_share: float):
+    conn.execute(CREATE_USERS)
+    conn.execute(CREATE_FLIGHT_TRACKERS)
+    conn.execute("ALTER TABLE flight_trackers ADD COLUMN last_sent_price INTEGER")
+    conn.executemany(
+        "INSERT INTO users (telegram_id, username, created_at) VALUES (?, ?, ?)",
+        ((1_000_000 + i, f"user{i}", "2025-01-01T00:00:00") for i in range(USERS)),
+    )
+    conn.executemany(
+        """INSERT INTO flight_trackers (user_id, origin, destination, date, price_limit, active)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (
+            (random.randint(1, USERS), random.choice(AIRPORTS), random.choice(AIRPORTS),
+             _random_date(), random.randint(3000, 30000), 1 if random.random() < active_share else 0)
+            for _ in range(rows)
+        ),
+    )
+    conn.commit()
+
+
+def _measure(conn: sqlite3.Connection, repeats: int) -> dict:
+    result = {}
+    for name, (sql, params) in QUERIES.items():
+        runs = 5 if name == "get_active_trackers" else repeats
+        timings = []
+        for _ in range(runs):
+            args = params()
+            started = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        result[name] = statistics.median(timings)
+    return result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    active_share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        # Как в Database.connect (DB_CACHE_SIZE_KB по умолчанию)
+        conn.execute("PRAGMA cache_size = -16384")
+        started = time.perf_counter()
+        _fill(conn, rows, active_share)
+        print(f"{rows} трекеров ({active_share:.0%} активных), заполнение {time.perf_counter() - started:.1f} с")
+
+        before = _measure(conn, repeats=20)
+        for statement in TRACKER_INDEXES:
+            conn.execute(statement)
+        conn.execute("ANALYZE")
+        after = _measure(conn, repeats=200)
+        conn.close()
+
+    print(f"{'запрос':<24}{'без индексов, мс':>18}{'с индексами, мс':>18}")
+    for name in QUERIES:
+        print(f"{name:<24}{before[name]:>18.3f}{after[name]:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,173 @@
+import asyncio
+import os
+import sqlite3
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
 import aiosqlite
 import datetime
 
+from db_handlers.migrations import migrate
+
+DB_PATH = os.getenv("DB_PATH", "trackers.db")
+# Размер кэша страниц SQLite (КиБ) и число подготовленных выражений, которые держит соединение
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Групповой коммит: накопленные записи фиксируются не реже раза в интервал
+# или сразу, как только их набралось DB_COMMIT_BATCH
+DB_COMMIT_INTERVAL = float(os.getenv("DB_COMMIT_INTERVAL", "0.05"))
+DB_COMMIT_BATCH = int(os.getenv("DB_COMMIT_BATCH", "200"))
+# Через сколько секунд повторить коммит, если предыдущий не удался (например, SQLITE_BUSY)
+DB_RETRY_INTERVAL = float(os.getenv("DB_RETRY_INTERVAL", "1.0"))
+
 
 class Database:
-    def __init__(self, db_path="trackers.db"):
+    """Одно долгоживущее соединение aiosqlite на процесс.
+
+    Все запросы идут через него (aiosqlite и так выполняет их по очереди в своём потоке),
+    база работает в режиме WAL: чтения не ждут записи, а fsync — только на контрольных точках.
+
+    Записи фиксируются групповым коммитом (см. flush):
+    - last_sent_price — write-behind: обновления одного трекера схлопываются в последнее,
+      вызывающий не ждёт коммита, а get_last_sent_price сразу видит новое значение;
+    - остальные записи ждут ближайшего общего коммита, поэтому после возврата они на диске;
+    - удаление доставленных сообщений outbox — write-behind без ожидания.
+    Неудачный коммит откатывается целиком: ожидающие получают ошибку, write-behind записи
+    остаются в очереди и повторяются через DB_RETRY_INTERVAL.
+    При аварийном завершении теряется не больше DB_COMMIT_INTERVAL обновлений last_sent_price
+    (худший случай — повторное уведомление о той же цене). close() дописывает всё накопленное.
+    """
+
+    def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
+        self.db = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self._pending_prices: Dict[int, int] = {}
+        self._pending_ops: List[Tuple[str, tuple, Optional[asyncio.Future]]] = []
+        self._flush_timer = None  # type: Optional[asyncio.TimerHandle]
+        self._flush_tasks = set()
 
     async def connect(self):
-        self.db = await aiosqlite.connect(self.db_path)
-        # чтобы возвращать словари, а не кортежи
-        self.db.row_factory = aiosqlite.Row
+        """Открывает соединение при первом вызове; повторные вызовы ничего не делают."""
+        if self.db is not None:
+            return self.db
+        async with self._connect_lock:
+            if self.db is None:
+                # cached_statements — кэш подготовленных выражений sqlite3 для повторяющихся запросов
+                conn = await aiosqlite.connect(self.db_path, cached_statements=DB_CACHED_STATEMENTS)
+                # чтобы возвращать словари, а не кортежи
+                conn.row_factory = aiosqlite.Row
+                await conn.execute("PRAGMA journal_mode = WAL")
+                # В WAL режим NORMAL не теряет целостность, а fsync на каждый commit не нужен
+                await conn.execute("PRAGMA synchronous = NORMAL")
+                await conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+                await conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+                await conn.execute("PRAGMA temp_store = MEMORY")
+                self.db = conn
+        return self.db
 
     async def close(self):
-        await self.db.close()
+        if self.db is not None:
+            try:
+                await self.flush()
+                await self.db.close()
+            finally:
+                self.db = None
+
+    async def flush(self):
+        """Выполняет накопленные записи и фиксирует их одним commit.
+
+        Все записи процесса (включая INSERT с возвратом id) выполняются только здесь,
+        под _write_lock: откат неудачного коммита не может задеть чужой INSERT.
+        """
+        async with self._write_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self.db is None:
+                return
+            prices = dict(self._pending_prices)
+            ops, self._pending_ops = self._pending_ops, []
+            if not (prices or ops):
+                return
+            results = []
+            try:
+                for sql, params, waiter in ops:
+                    try:
+                        cursor = await self.db.execute(sql, params)
+                    except sqlite3.IntegrityError as e:
+                        # Нарушение ограничения откатывает только этот оператор, не транзакцию
+                        results.append(e)
+                        continue
+                    results.append(cursor.lastrowid)
+                if prices:
+                    await self.db.executemany(
+                        "UPDATE flight_trackers SET last_sent_price = ? WHERE id = ?",
+                        [(price, tracker_id) for tracker_id, price in prices.items()],
+                    )
+                await self.db.commit()
+            except Exception as e:
+                # Ожидающие получают ошибку; write-behind записи и цены остаются до следующей попытки
+                print(f"Ошибка группового коммита: {e}")
+                try:
+                    await self.db.rollback()
+                except Exception:
+                    pass
+                self._pending_ops[:0] = [op for op in ops if op[2] is None]
+                for _, _, waiter in ops:
+                    if waiter is not None and not waiter.done():
+                        waiter.set_exception(e)
+                self._retry_flush()
+                return
+            for tracker_id, price in prices.items():
+                # За время записи могло прийти более новое значение — его оставляем
+                if self._pending_prices.get(tracker_id) == price:
+                    del self._pending_prices[tracker_id]
+            for (sql, _, waiter), result in zip(ops, results):
+                if isinstance(result, Exception):
+                    if waiter is not None and not waiter.done():
+                        waiter.set_exception(result)
+                    elif waiter is None:
+                        print(f"Ошибка отложенной записи ({sql.split()[0]}): {result}")
+                elif waiter is not None and not waiter.done():
+                    waiter.set_result(result)
+
+    async def _execute_write(self, sql: str, params: tuple) -> int:
+        """Ставит запись в ближайший групповой коммит и ждёт его; возвращает lastrowid."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending_ops.append((sql, params, waiter))
+        self._schedule_flush()
+        return await waiter
+
+    def _queue_write(self, sql: str, params: tuple):
+        """Write-behind: запись уйдёт ближайшим групповым коммитом, без ожидания."""
+        self._pending_ops.append((sql, params, None))
+        self._schedule_flush()
+
+    def _retry_flush(self):
+        if self._flush_timer is None and (self._pending_prices or self._pending_ops):
+            self._flush_timer = asyncio.get_running_loop().call_later(DB_RETRY_INTERVAL, self._start_flush)
+
+    def _schedule_flush(self):
+        pending = len(self._pending_prices) + len(self._pending_ops)
+        if pending >= DB_COMMIT_BATCH:
+            self._start_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(DB_COMMIT_INTERVAL, self._start_flush)
+
+    def _start_flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        task = asyncio.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
 
     async def init_db(self):
         await self.connect()
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                username TEXT,
-                created_at TEXT
-            )
-        """)
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS flight_trackers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                origin TEXT,
-                destination TEXT,
-                date TEXT,
-                price_limit INTEGER,
-                active INTEGER DEFAULT 1,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-        try:
-            async with self.db.execute("PRAGMA table_info('flight_trackers')") as cursor:
-                cols = [row[1] async for row in cursor]
-            if "last_sent_price" not in cols:
-                await self.db.execute("ALTER TABLE flight_trackers ADD COLUMN last_sent_price INTEGER")
-        except Exception:
-            pass
-        await self.db.commit()
+        await migrate(self.db)
 
     async def add_user(self, telegram_id: int, username: str = None):
         async with self.db.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)) as cursor:
@@ -51,39 +175,47 @@ class Database:
         if user:
             return user["id"]
         created_at = datetime.datetime.utcnow().isoformat()
-        cursor = await self.db.execute(
-            "INSERT INTO users (telegram_id, username, created_at) VALUES (?, ?, ?)",
-            (telegram_id, username, created_at)
-        )
-        await self.db.commit()
-        return cursor.lastrowid
+        try:
+            return await self._execute_write(
+                "INSERT INTO users (telegram_id, username, created_at) VALUES (?, ?, ?)",
+                (telegram_id, username, created_at)
+            )
+        except sqlite3.IntegrityError:
+            # Параллельный add_user того же пользователя успел раньше
+            async with self.db.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)) as cursor:
+                return (await cursor.fetchone())["id"]
 
     async def add_flight_tracker(self, user_id: int, origin: str, destination: str, date: str, price_limit: int) -> int:
-        cursor = await self.db.execute("""
+        return await self._execute_write("""
             INSERT INTO flight_trackers (user_id, origin, destination, date, price_limit, active)
             VALUES (?, ?, ?, ?, ?, 1)
         """, (user_id, origin, destination, date, price_limit))
-        await self.db.commit()
-        return cursor.lastrowid
 
     async def get_active_trackers(self):
-        trackers = []
+        return [tracker async for tracker in self.iter_active_trackers()]
+
+    async def iter_active_trackers(self, batch_size: int = 500) -> AsyncIterator[dict]:
+        """Активные трекеры порциями по `batch_size`, без загрузки всей выборки в память."""
         async with self.db.execute("""
-            SELECT ft.id, u.telegram_id, ft.origin, ft.destination, ft.date, ft.price_limit
+            SELECT ft.id, u.telegram_id, ft.origin, ft.destination, ft.date, ft.price_limit, ft.last_sent_price
             FROM flight_trackers ft
             JOIN users u ON ft.user_id = u.id
             WHERE ft.active = 1
         """) as cursor:
-            async for row in cursor:
-                trackers.append({
-                    "tracker_id": row["id"],
-                    "telegram_id": row["telegram_id"],
-                    "origin": row["origin"],
-                    "destination": row["destination"],
-                    "date": row["date"],
-                    "price_limit": row["price_limit"]
-                })
-        return trackers
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield {
+                        "tracker_id": row["id"],
+                        "telegram_id": row["telegram_id"],
+                        "origin": row["origin"],
+                        "destination": row["destination"],
+                        "date": row["date"],
+                        "price_limit": row["price_limit"],
+                        "last_sent_price": row["last_sent_price"]
+                    }
 
     async def get_user_trackers(self, user_id: int):
         trackers = []
@@ -118,14 +250,14 @@ class Database:
             return await cursor.fetchone() is not None
 
     async def deactivate_tracker(self, tracker_id: int):
-        await self.db.execute("UPDATE flight_trackers SET active = 0 WHERE id = ?", (tracker_id,))
-        await self.db.commit()
+        await self._execute_write("UPDATE flight_trackers SET active = 0 WHERE id = ?", (tracker_id,))
 
     async def deactivate_all_user_trackers(self, user_id: int):
-        await self.db.execute("UPDATE flight_trackers SET active = 0 WHERE user_id = ?", (user_id,))
-        await self.db.commit()
+        await self._execute_write("UPDATE flight_trackers SET active = 0 WHERE user_id = ? AND active = 1", (user_id,))
 
     async def get_last_sent_price(self, tracker_id: int):
+        if tracker_id in self._pending_prices:
+            return self._pending_prices[tracker_id]
         async with self.db.execute(
             "SELECT last_sent_price FROM flight_trackers WHERE id = ?",
             (tracker_id,)
@@ -136,11 +268,63 @@ class Database:
             return row[0]
 
     async def update_last_sent_price(self, tracker_id: int, price: int):
-        await self.db.execute(
-            "UPDATE flight_trackers SET last_sent_price = ? WHERE id = ?",
-            (int(price), tracker_id)
+        """Write-behind: значение попадёт в базу ближайшим групповым коммитом."""
+        self._pending_prices[tracker_id] = int(price)
+        self._schedule_flush()
+
+    async def add_outbox_message(self, chat_id: int, text: str, options: str, priority: int, owner: str) -> int:
+        """Кладёт сообщение в спул; после возврата оно на диске."""
+        return await self._execute_write(
+            """INSERT INTO outbox (chat_id, text, options, priority, owner, claimed_at, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (chat_id, text, options, priority, owner, time.time(), datetime.datetime.utcnow().isoformat())
+        )
+
+    def delete_outbox_message(self, message_id: int):
+        self._queue_write("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+    async def claim_outbox_messages(self, owner: str, stale_before: Optional[float] = None, limit: int = 500):
+        """Забирает себе чужие недоставленные сообщения: ничьи, с захватом старше `stale_before`
+        или (stale_before=None) все. Возвращает не больше `limit` строк, захваченных этим вызовом.
+        """
+        if stale_before is None:
+            condition, params = "owner IS NOT ?", (owner,)
+        else:
+            condition, params = "(owner IS NULL OR claimed_at < ?)", (stale_before,)
+        async with self.db.execute(
+            f"SELECT id FROM outbox WHERE {condition} ORDER BY id LIMIT ?", params + (limit,)
+        ) as cursor:
+            ids = [row["id"] async for row in cursor]
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        # Условие повторяется в UPDATE: параллельный захват другим процессом не перезаписывается
+        await self._execute_write(
+            f"UPDATE outbox SET owner = ?, claimed_at = ? WHERE id IN ({marks}) AND {condition}",
+            (owner, time.time(), *ids) + params
         )
-        await self.db.commit()
+        messages = []
+        async with self.db.execute(
+            f"SELECT id, chat_id, text, options, priority FROM outbox WHERE owner = ? AND id IN ({marks}) ORDER BY id",
+            (owner, *ids)
+        ) as cursor:
+            async for row in cursor:
+                messages.append({
+                    "id": row["id"],
+                    "chat_id": row["chat_id"],
+                    "text": row["text"],
+                    "options": row["options"],
+                    "priority": row["priority"]
+                })
+        return messages
+
+    async def refresh_outbox_claims(self, owner: str):
+        """Heartbeat: продлевает захват своих сообщений, чтобы их не забрали живому процессу."""
+        await self._execute_write("UPDATE outbox SET claimed_at = ? WHERE owner = ?", (time.time(), owner))
+
+    async def release_outbox_messages(self, owner: str):
+        """Отпускает захваченные сообщения, чтобы их сразу подхватил следующий процесс."""
+        await self._execute_write("UPDATE outbox SET owner = NULL, claimed_at = NULL WHERE owner = ?", (owner,))
 
 
 db = Database()
@@ -0,0 +1,125 @@
+"""Версионные миграции схемы SQLite.
+
+Номер применённой версии хранится в `PRAGMA user_version`. Каждая миграция
+выполняется в своей транзакции вместе с обновлением номера, поэтому прерванный
+запуск просто повторит её при следующем старте. Новые изменения схемы —
+только новой записью в MIGRATIONS, старые не редактируются.
+"""
+from typing import Awaitable, Callable, List, Tuple
+
+CREATE_USERS = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER UNIQUE,
+        username TEXT,
+        created_at TEXT
+    )
+"""
+
+CREATE_FLIGHT_TRACKERS = """
+    CREATE TABLE IF NOT EXISTS flight_trackers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        origin TEXT,
+        destination TEXT,
+        date TEXT,
+        price_limit INTEGER,
+        active INTEGER DEFAULT 1,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+"""
+
+# Частичные индексы только по активным трекерам: отключённые строки копятся,
+# но в индексы не попадают и на время запросов не влияют.
+# get_user_trackers / count_active_trackers — по префиксу user_id, tracker_exists — целиком
+USER_ACTIVE_INDEX = """CREATE INDEX IF NOT EXISTS idx_flight_trackers_user_active
+    ON flight_trackers (user_id, origin, destination, date) WHERE active = 1"""
+# Выборки по маршруту; для get_active_trackers ещё и покрывающий — без чтения строк таблицы
+ROUTE_ACTIVE_INDEX = """CREATE INDEX IF NOT EXISTS idx_flight_trackers_route_active
+    ON flight_trackers (origin, destination, date, user_id, price_limit, last_sent_price) WHERE active = 1"""
+
+# Набор индексов актуальной версии схемы
+TRACKER_INDEXES = [USER_ACTIVE_INDEX, ROUTE_ACTIVE_INDEX]
+
+
+async def _column_names(conn, table: str) -> List[str]:
+    async with conn.execute(f"PRAGMA table_info('{table}')") as cursor:
+        return [row[1] async for row in cursor]
+
+
+async def _v1_base_schema(conn):
+    await conn.execute(CREATE_USERS)
+    await conn.execute(CREATE_FLIGHT_TRACKERS)
+
+
+async def _v2_last_sent_price(conn):
+    # Базы, созданные до миграций, могли уже получить колонку прежним ALTER TABLE
+    if "last_sent_price" not in await _column_names(conn, "flight_trackers"):
+        await conn.execute("ALTER TABLE flight_trackers ADD COLUMN last_sent_price INTEGER")
+
+
+async def _v3_tracker_indexes(conn):
+    await conn.execute(USER_ACTIVE_INDEX)
+    await conn.execute("""CREATE INDEX IF NOT EXISTS idx_flight_trackers_route_active
+        ON flight_trackers (origin, destination, date, user_id, price_limit) WHERE active = 1""")
+    await conn.execute("ANALYZE")
+
+
+async def _v4_route_index_last_sent_price(conn):
+    # get_active_trackers читает last_sent_price для состояния трекеров в памяти
+    await conn.execute("DROP INDEX IF EXISTS idx_flight_trackers_route_active")
+    await conn.execute(ROUTE_ACTIVE_INDEX)
+    await conn.execute("ANALYZE")
+
+
+async def _v5_outbox(conn):
+    # Уведомления ждут здесь отправки: переживают рестарт и временные ошибки Telegram.
+    # owner/claimed_at — какой процесс сейчас отвечает за доставку
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            options TEXT,
+            priority INTEGER NOT NULL DEFAULT 1,
+            owner TEXT,
+            claimed_at REAL,
+            created_at TEXT
+        )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_owner ON outbox (owner, claimed_at)")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[object], Awaitable[None]]]] = [
+    (1, "базовая схема users / flight_trackers", _v1_base_schema),
+    (2, "flight_trackers.last_sent_price", _v2_last_sent_price),
+    (3, "частичные индексы по активным трекерам", _v3_tracker_indexes),
+    (4, "last_sent_price в покрывающем индексе маршрутов", _v4_route_index_last_sent_price),
+    (5, "спул исходящих сообщений outbox", _v5_outbox),
+]
+
+
+async def get_schema_version(conn) -> int:
+    async with conn.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+async def migrate(conn) -> int:
+    """Применяет недостающие миграции к соединению aiosqlite; возвращает версию схемы."""
+    current = await get_schema_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            await conn.execute("BEGIN")
+            await apply(conn)
+            # PRAGMA не принимает параметры; version — целое из списка выше
+            await conn.execute(f"PRAGMA user_version = {int(version)}")
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Миграция {version} ({description}) не применена: {e}")
+            raise
+        current = version
+    return current
@@ -5,13 +5,34 @@ from db_handlers.db_class import db
 from utils.airport_codes import get_airport_name
 from utils.aviasales_api import CURRENCY
 from utils.validators import format_iso_date_to_user, format_price
-from handlers.task import tracker_tasks
+from utils.sharding import stop_tracking
+from utils.scheduler import scheduler
 
 router = Router()
 
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 90:
+        return f"{int(seconds)} с"
+    if seconds < 5400:
+        return f"{round(seconds / 60)} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+
+def _cadence_line(tracker: dict) -> str:
+    """Как часто опрашивается трекер — если опрос идёт в этом процессе (RUN_MODE=all)."""
+    cadence = scheduler.cadence(tracker["tracker_id"]) if scheduler.running else None
+    if cadence is None:
+        return ""
+    return (
+        f"\n• {get_airport_name(tracker['origin'])} → {get_airport_name(tracker['destination'])}, "
+        f"{format_iso_date_to_user(tracker['date'][0])}: проверка каждые {_format_seconds(cadence['interval'])}, "
+        f"следующая через {_format_seconds(cadence['next_check_in'])}"
+    )
+
+
 @router.message(lambda msg: msg.text == "📋 Мои отслеживания")
 async def list_user_trackers(message: types.Message, state: FSMContext):
-    await db.connect()
     try:
         # Сбрасываем FSM, чтобы пользовательский ввод не перехватывали состояния поиска городов
         try:
@@ -34,7 +55,9 @@ async def list_user_trackers(message: types.Message, state: FSMContext):
             return
 
         kb_rows = []
+        cadence_lines = []
         for t in trackers:
+            cadence_lines.append(_cadence_line(t))
             title = (
                 f"(Удалить){get_airport_name(t['origin'])} → {get_airport_name(t['destination'])} | "
                 f"{format_iso_date_to_user(t['date'][0])} | ≤ {format_price(t['price_limit'])} {CURRENCY.upper()}"
@@ -44,7 +67,11 @@ async def list_user_trackers(message: types.Message, state: FSMContext):
             ])
 
         kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
-        await message.answer("📡 <b>Активные отслеживания:</b>", reply_markup=kb)
+        text = "📡 <b>Активные отслеживания:</b>" + "".join(cadence_lines)
+        if len(text) > 4000:
+            # Лимит Telegram на длину сообщения — без расписания опроса
+            text = "📡 <b>Активные отслеживания:</b>"
+        await message.answer(text, reply_markup=kb)
 
     except Exception as e:
         print(f"Ошибка при выводе отслеживаний: {e}")
@@ -60,22 +87,12 @@ async def stop_selected_tracker(callback: types.CallbackQuery):
         await callback.answer("Некорректный идентификатор", show_alert=False)
         return
 
-    # Отключаем в БД
+    # Отключаем в БД и снимаем с расписания опроса (в своём процессе или у воркера)
     try:
-        await db.connect()
-        await db.deactivate_tracker(tracker_id)
+        await stop_tracking(tracker_id)
     except Exception:
         pass
 
-    # Останавливаем соответствующую задачу, если есть
-    task = tracker_tasks.pop(tracker_id, None)
-    if task and not task.done():
-        task.cancel()
-        try:
-            await task
-        except Exception:
-            pass
-
     await callback.answer("Отслеживание остановлено")
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.message.answer("❌ Отслеживание отключено.")
@@ -12,7 +12,6 @@ async def start_command(message: types.Message, state: FSMContext):
         await state.clear()
     except Exception:
         pass
-    await db.connect()
     user_id = await db.add_user(message.from_user.id, message.from_user.username)
     await message.answer(
         "👋 Привет! Я бот для отслеживания статусов авиарейсов и дешёвых авиабилетов.\n\n"
@@ -1,5 +0,0 @@
-user_tasks = {}  # ключ: telegram_id, значение: список asyncio.Task
-
-
-# Ключ: tracker_id (int), значение: asyncio.Task
-tracker_tasks = {}
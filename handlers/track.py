@@ -6,17 +6,17 @@ import asyncio
 from datetime import datetime
 
 from db_handlers.db_class import db
-from handlers.task import user_tasks, tracker_tasks
-from utils.track_flight import track_flight
-from utils.airport_codes import get_airport_name, find_airports_by_city, format_airport_option
+from utils.sharding import start_tracking
+from utils.airport_codes import get_airport_name, find_airports_by_city, suggest_airports, format_airport_option
 from utils.aviasales_api import CURRENCY, get_price_for_date
 from utils.validators import is_valid_date, parse_user_date_to_iso, format_iso_date_to_user, format_price
 from utils.flightradar_client import get_flight_status_by_number
-from utils.airlines_icao import get_airline_by_icao
 
 router = Router()
 
 MAX_ACTIVE_TRACKERS = 5
+# Сколько дат из одной команды /track проверяется через API одновременно
+TRACK_VALIDATION_CONCURRENCY = 4
 
 
 
@@ -83,11 +83,11 @@ async def handle_flight_number(message: types.Message, state: FSMContext):
 
     airline_raw = str(flight.get('airline', '') or '').strip()
     airline_line = f"Авиакомпания: {airline_raw}"
-    maybe_code = airline_raw.upper()
-    if len(maybe_code) == 3 and maybe_code.isalpha():
-        name, country = get_airline_by_icao(maybe_code)
-        if name or country:
-            airline_line = f"Авиакомпания: {name}{f' ({country})' if country else ''}"
+    # Название по ICAO-коду уже подставлено клиентом FR24
+    airline_info = flight.get('airline_info') or {}
+    if airline_info:
+        name, country = airline_info.get('name', ''), airline_info.get('country', '')
+        airline_line = f"Авиакомпания: {name}{f' ({country})' if country else ''}"
 
     text = (
         f"✈️ Рейс <b>{flight.get('flight_number', flight_number)}</b>\n"
@@ -164,11 +164,10 @@ async def handle_history_flight_number(message: types.Message, state: FSMContext
 
         airline_raw = str(item.get('airline', '') or '').strip()
         airline_line = f"{airline_raw}"
-        maybe_code = airline_raw.upper()
-        if len(maybe_code) == 3 and maybe_code.isalpha():
-            name, country = get_airline_by_icao(maybe_code)
-            if name or country:
-                airline_line = f"{name}{f' ({country})' if country else ''}"
+        airline_info = item.get('airline_info') or {}
+        if airline_info:
+            name, country = airline_info.get('name', ''), airline_info.get('country', '')
+            airline_line = f"{name}{f' ({country})' if country else ''}"
         flight_num = item.get('flight_number', flight_number)
 
         duration_line = ""
@@ -263,7 +262,6 @@ def _fmt_minutes_to_hhmm(total_min):
 
 @router.message(Command("track"))
 async def track_command(message: types.Message):
-    await db.connect()
     try:
         args = message.text.split()[1:]  # убираем /track
         if len(args) != 4:
@@ -294,9 +292,15 @@ async def track_command(message: types.Message):
         skipped = []  # список кортежей (date, reason)
         to_start = []  # список параметров для запуска трекеров после уведомления
 
-        for date_user in dates_raw:
+        # Запросы к API по всем корректным датам идут параллельно (с ограничением),
+        # а проверки ниже применяются строго в порядке дат из команды
+        parsed_dates = [(date_user, parse_user_date_to_iso(date_user)) for date_user in dates_raw]
+        flights = await _lookup_flights(
+            origin, destination, [iso_date for _, iso_date in parsed_dates if iso_date]
+        )
+
+        for date_user, iso_date in parsed_dates:
             # 1) проверка формата/прошлого времени (ожидаем ДД-ММ-ГГГГ)
-            iso_date = parse_user_date_to_iso(date_user)
             if not iso_date:
                 skipped.append((date_user, "неверная дата (формат ДД-ММ-ГГГГ или дата в прошлом)"))
                 continue
@@ -307,7 +311,7 @@ async def track_command(message: types.Message):
                 continue
 
             # 3) проверка через API (валидность IATA + есть ли рейсы на эту дату)
-            flight = await get_price_for_date(origin, destination, iso_date)
+            flight = flights.get(iso_date)
             if not flight or (isinstance(flight, dict) and flight.get("error")):
                 skipped.append((date_user, "рейсы не найдены (проверь IATA-коды и дату)"))
                 continue
@@ -321,7 +325,7 @@ async def track_command(message: types.Message):
             tracker_id = await db.add_flight_tracker(user_id, origin, destination, iso_date, price_limit)
 
             # отложим запуск, чтобы сначала отправить статусное сообщение
-            to_start.append((tracker_id, iso_date, flight))
+            to_start.append((tracker_id, iso_date))
 
             added_dates_user.append(format_iso_date_to_user(iso_date))
             allowed_slots -= 1
@@ -336,22 +340,19 @@ async def track_command(message: types.Message):
                 f"Цена ниже <b>{format_price(price_limit)} {CURRENCY.upper()}</b>"
             )
 
-            # теперь запускаем трекеры, чтобы предложения пришли после статусного сообщения
-            user_tasks.setdefault(message.from_user.id, [])
-            for tracker_id, iso_date, initial_flight in to_start:
-                task = asyncio.create_task(
-                    track_flight(
-                        message.from_user.id,
-                        origin,
-                        destination,
-                        iso_date,
-                        price_limit,
-                        tracker_id=tracker_id,
-                        initial_flight=initial_flight
-                    )
-                )
-                user_tasks[message.from_user.id].append(task)
-                tracker_tasks[tracker_id] = task
+            # теперь запускаем трекеры, чтобы предложения пришли после статусного сообщения;
+            # первая проверка возьмёт цену из кэша, прогретого валидацией выше
+            for tracker_id, iso_date in to_start:
+                tracker = {
+                    "tracker_id": tracker_id,
+                    "telegram_id": message.from_user.id,
+                    "origin": origin,
+                    "destination": destination,
+                    "date": iso_date,
+                    "price_limit": price_limit,
+                    "last_sent_price": None,
+                }
+                await start_tracking(tracker)
 
         # Сводка по пропущенным датам (если есть)
         if skipped:
@@ -365,6 +366,23 @@ async def track_command(message: types.Message):
         )
 
 
+async def _lookup_flights(origin: str, destination: str, iso_dates: list) -> dict:
+    """Параллельно получает цены по датам: {iso_date: flight}."""
+    semaphore = asyncio.Semaphore(TRACK_VALIDATION_CONCURRENCY)
+    unique_dates = list(dict.fromkeys(iso_dates))
+
+    async def _one(iso_date: str):
+        async with semaphore:
+            # устаревший ответ из кэша годится для проверки — обновление идёт в фоне
+            return await get_price_for_date(origin, destination, iso_date, allow_stale=True)
+
+    results = await asyncio.gather(*(_one(d) for d in unique_dates), return_exceptions=True)
+    return {
+        iso_date: (None if isinstance(result, BaseException) else result)
+        for iso_date, result in zip(unique_dates, results)
+    }
+
+
 @router.message(lambda msg: msg.text == "✈ Отслеживать")
 async def track_button_handler(message: types.Message, state: FSMContext):
     # Запускаем диалог по сбору данных в человеко-понятном виде
@@ -386,6 +404,19 @@ async def tracking_info_handler(message: types.Message):
 
 # ===== Диалог FSM для отслеживания по городам/датам/цене =====
 
+async def _offer_suggestions(message: types.Message, state: FSMContext, text: str, options_key: str):
+    # Точного совпадения нет — предлагаем похожие города (опечатки, транслит)
+    suggestions = suggest_airports(text)
+    if not suggestions:
+        await message.answer("Не нашёл аэропорты для этого города. Попробуйте ещё раз.")
+        return
+    list_text = "Не нашёл такой город. Возможно, вы имели в виду (выберите номер):\n" + "\n".join(
+        [f"{idx+1}. {format_airport_option(iata, label)}" for idx, (iata, label) in enumerate(suggestions)]
+    )
+    await state.update_data({options_key: suggestions})
+    await message.answer(list_text)
+
+
 @router.message(TrackFSM.waiting_origin_city)
 async def handle_origin_city(message: types.Message, state: FSMContext):
     text = (message.text or "").strip()
@@ -405,7 +436,7 @@ async def handle_origin_city(message: types.Message, state: FSMContext):
     # Иначе — воспринимаем как ввод города
     options = find_airports_by_city(text)
     if not options:
-        await message.answer("Не нашёл аэропорты для этого города. Попробуйте ещё раз.")
+        await _offer_suggestions(message, state, text, "origin_options")
         return
     if len(options) == 1:
         iata, label = options[0]
@@ -441,7 +472,7 @@ async def handle_destination_city(message: types.Message, state: FSMContext):
     # Иначе — анализ города
     options = find_airports_by_city(text)
     if not options:
-        await message.answer("Не нашёл аэропорты для этого города. Попробуйте ещё раз.")
+        await _offer_suggestions(message, state, text, "destination_options")
         return
     if len(options) == 1:
         iata, label = options[0]
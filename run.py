@@ -1,24 +1,73 @@
 import asyncio
+import signal
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from create_bot import bot
 from handlers import register_handlers
 from db_handlers.db_class import db
 from utils.restore_all_trackers import restore_all_trackers
 from utils.icao_seed import seed_icao_if_needed
+from utils.scheduler import scheduler
+from utils.sharding import RUN_MODE, ShardCoordinator
+from utils.webhook import UPDATES_MODE, run_webhook
+from utils.fsm_storage import create_fsm_storage
+from utils.outbox import outbox
+from utils.alert_digest import alert_digest
+from utils.aviasales_api import init_session, close_session
+from utils.redis_client import close_async_redis
+from utils.flightradar_client import close_fr24_client
+
+
+async def run_worker():
+    """Работает до SIGINT/SIGTERM; по сигналу координатор отпускает аренды, дальше — обычная остановка."""
+    coordinator = asyncio.create_task(ShardCoordinator().run())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, coordinator.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await coordinator
+    except asyncio.CancelledError:
+        pass
 
 
 async def main():
     await db.init_db()
-    # Пытаемся заполнить Redis данными ICAO (без падения при ошибке)
+    # Синхронизация ICAO в Redis идёт в фоне и не задерживает старт опроса
+    seed_task = asyncio.create_task(seed_icao_if_needed())
+    await init_session()
+    # В RUN_MODE=all процесс один — забираем весь недоставленный спул
+    await outbox.start(claim_all=(RUN_MODE == "all"))
+    # RUN_MODE=bot только принимает апдейты, трекеры опрашивают процессы RUN_MODE=worker
+    if RUN_MODE != "bot":
+        scheduler.start()
     try:
-        seed_icao_if_needed()
-    except Exception:
-        pass
-    dp = Dispatcher(storage=MemoryStorage())
-    register_handlers(dp)
-    await restore_all_trackers()
-    await dp.start_polling(bot)
+        if RUN_MODE == "worker":
+            await run_worker()
+        else:
+            if RUN_MODE == "all":
+                await restore_all_trackers()
+            dp = Dispatcher(storage=await create_fsm_storage())
+            register_handlers(dp)
+            if UPDATES_MODE == "webhook":
+                await run_webhook(dp, bot)
+            else:
+                # getUpdates не работает, пока у бота установлен webhook
+                await bot.delete_webhook(drop_pending_updates=False)
+                await dp.start_polling(bot)
+    finally:
+        seed_task.cancel()
+        await asyncio.gather(seed_task, return_exceptions=True)
+        await scheduler.stop()
+        await close_session()
+        close_fr24_client()
+        # Накопленные сводки — в спул outbox, чтобы не потерять их при остановке
+        await alert_digest.flush_all()
+        await outbox.stop()
+        # Redis закрываем последним: flush_all и outbox.stop ещё обращаются к нему
+        await close_async_redis()
+        await db.close()
 
 if __name__ == '__main__':
     asyncio.run(main())  # <<< Запуск asyncio-цикла
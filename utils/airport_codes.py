@@ -1,4 +1,7 @@
+from utils.city_index import CityIndex, normalize_text
 
+
+# Порядок важен: сначала крупные хабы — по нему ранжируются подсказки suggest_airports
 airport_names = {
     "SVO": "Москва (Шереметьево)",
     "DME": "Москва (Домодедово)",
@@ -111,14 +114,13 @@ def get_airport_name(code: str) -> str:
 
 
 def _normalize_text(value: str) -> str:
-    s = (value or "").strip().lower()
-    # Приводим разные дефисы/тире к пробелам и убираем редкие символы
-    for ch in ["\u2011", "\u2013", "\u2014", "\u2212", "-", "\u00a0"]:
-        s = s.replace(ch, " ")
-    s = s.replace("ё", "е")
-    while "  " in s:
-        s = s.replace("  ", " ")
-    return s
+    return normalize_text(value)
+
+
+# Индекс строится один раз при импорте: поиск — бинарный по отсортированным ключам
+_city_index = CityIndex(
+    (code, label.split(" (")[0], label) for code, label in airport_names.items()
+)
 
 
 def find_airports_by_city(city_query: str):
@@ -127,22 +129,15 @@ def find_airports_by_city(city_query: str):
     Сопоставляет по началу строки до скобок: например,
     "Москва (Домодедово)" → городовая часть "Москва".
     Ищет варианты, у которых городовая часть начинается с переданным запросом.
+    Латиницей тоже находит: "moskva", "Moscow".
     """
-    query = _normalize_text(city_query)
-    if not query:
-        return []
-
-    results = []
-    for code, label in airport_names.items():
-        # Берём часть до первой скобки как город
-        city_part = label.split(" (")[0]
-        city_norm = _normalize_text(city_part)
-        if city_norm.startswith(query) or query.startswith(city_norm):
-            results.append((code, label))
-
-    # Упорядочим стабильно по названию (для красивого вывода)
-    results.sort(key=lambda x: _normalize_text(x[1]))
-    return results
+    return _city_index.search(city_query)
+
+
+def suggest_airports(city_query: str, limit: int = 5):
+    """Варианты [(IATA, label)] для запроса с опечаткой: "Масква", "Kaliningard"."""
+    from utils.fuzzy_search import get_iata_search_engine
+    return get_iata_search_engine().search(city_query, limit=limit)
 
 
 def format_airport_option(iata: str, label: str) -> str:
@@ -0,0 +1,138 @@
+import asyncio
+import os
+from typing import Dict, List
+
+from utils.aviasales_api import CURRENCY
+from utils.airport_codes import get_airport_name
+from utils.outbox import outbox
+from utils.tracker_state import tracker_states
+from utils.validators import format_iso_datetime_to_user, format_price, format_iso_date_to_user
+
+# Сколько секунд копить уведомления пользователя перед отправкой; 0 — отправлять сразу
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "5"))
+# Лимит Telegram на длину сообщения 4096 символов — длинную сводку делим с запасом
+DIGEST_MAX_CHARS = 3500
+
+
+def _single_text(alert: dict) -> str:
+    return (
+        f"✈️ <b>{get_airport_name(alert['origin'])}</b> → <b>{get_airport_name(alert['destination'])}</b>\n"
+        f"📅 Дата: <b>{format_iso_date_to_user(alert['date'])}</b>\n"
+        f"Цена: <b>{format_price(alert['price'])} {CURRENCY.upper()}</b>\n"
+        f"Авиакомпания: <b>{alert['airline']}</b>\n"
+        f"Вылет: {format_iso_datetime_to_user(alert['departure_at'])}\n"
+        f"<a href='https://www.aviasales.ru{alert['link']}'>🔗 Купить билет</a>"
+    )
+
+
+def _digest_blocks(alerts: List[dict]) -> List[str]:
+    """Блоки сводки: по маршруту, внутри — лучшая цена на каждую дату."""
+    routes: Dict[tuple, List[dict]] = {}
+    for alert in alerts:
+        routes.setdefault((alert["origin"], alert["destination"]), []).append(alert)
+
+    blocks = []
+    for (origin, destination), route_alerts in routes.items():
+        lines = [f"✈️ <b>{get_airport_name(origin)}</b> → <b>{get_airport_name(destination)}</b>"]
+        for alert in sorted(route_alerts, key=lambda a: a["date"]):
+            lines.append(
+                f"📅 {format_iso_date_to_user(alert['date'])}: "
+                f"<b>{format_price(alert['price'])} {CURRENCY.upper()}</b>, {alert['airline']}, "
+                f"вылет {format_iso_datetime_to_user(alert['departure_at'])} "
+                f"<a href='https://www.aviasales.ru{alert['link']}'>🔗</a>"
+            )
+        blocks.append("\n".join(lines))
+    return blocks
+
+
+def render_alerts(alerts: List[dict]) -> List[str]:
+    """Тексты сообщений для набора уведомлений одного пользователя."""
+    if len(alerts) == 1:
+        return [_single_text(alerts[0])]
+
+    messages = []
+    current = f"🔔 Цены ниже порога: {len(alerts)}"
+    for block in _digest_blocks(alerts):
+        if len(current) + len(block) + 2 > DIGEST_MAX_CHARS:
+            messages.append(current)
+            current = block
+        else:
+            current += "\n\n" + block
+    messages.append(current)
+    return messages
+
+
+class AlertDigest:
+    """Собирает уведомления о ценах по пользователю и отправляет их одним сообщением.
+
+    Первое уведомление открывает окно в DIGEST_WINDOW секунд; всё, что пришло
+    за это время, уходит одной сводкой (для трекера остаётся только лучшая цена).
+    last_sent_price каждого трекера обновляется после постановки сводки в outbox.
+    """
+
+    def __init__(self, window: float = DIGEST_WINDOW):
+        self.window = window
+        self._pending: Dict[int, Dict[int, dict]] = {}  # telegram_id -> tracker_id -> alert
+        self._timers: Dict[int, asyncio.Task] = {}
+
+    async def add(self, telegram_id: int, alert: dict):
+        """`alert`: tracker_id, origin, destination, date, price, airline, departure_at, link."""
+        if self.window <= 0:
+            await self._send(telegram_id, [alert])
+            return
+        alerts = self._pending.setdefault(telegram_id, {})
+        previous = alerts.get(alert["tracker_id"])
+        if previous is None or alert["price"] < previous["price"]:
+            alerts[alert["tracker_id"]] = alert
+        if telegram_id not in self._timers:
+            self._timers[telegram_id] = asyncio.create_task(self._flush_later(telegram_id))
+
+    async def _flush_later(self, telegram_id: int):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._timers.pop(telegram_id, None)
+        await self.flush(telegram_id)
+
+    async def flush(self, telegram_id: int):
+        alerts = self._pending.pop(telegram_id, None)
+        if not alerts:
+            return
+        # Трекер могли отключить или уже уведомить о цене не хуже, пока копилась сводка
+        fresh = []
+        for alert in alerts.values():
+            state = tracker_states.get(alert["tracker_id"])
+            if state is None or not state["active"]:
+                continue
+            last_sent = state["last_sent_price"]
+            if last_sent is not None and alert["price"] >= int(last_sent):
+                continue
+            fresh.append(alert)
+        if fresh:
+            await self._send(telegram_id, fresh)
+
+    async def flush_all(self):
+        """Отправляет всё накопленное без ожидания окна (при остановке)."""
+        timers, self._timers = list(self._timers.values()), {}
+        for task in timers:
+            task.cancel()
+        await asyncio.gather(*timers, return_exceptions=True)
+        for telegram_id in list(self._pending):
+            await self.flush(telegram_id)
+
+    async def _send(self, telegram_id: int, alerts: List[dict]):
+        try:
+            # Сообщение сначала попадает в спул outbox — дальше доставку гарантирует очередь
+            for text in render_alerts(alerts):
+                await outbox.send(telegram_id, text)
+        except Exception as e:
+            print(f"Ошибка постановки уведомления в очередь: {e}")
+            return
+        for alert in alerts:
+            try:
+                await tracker_states.record_sent(alert["tracker_id"], alert["price"])
+            except Exception:
+                pass
+
+
+alert_digest = AlertDigest()
@@ -1,35 +1,245 @@
+import asyncio
 import os
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
 import aiohttp
 
+from utils.rate_limiter import SharedTokenBucket, UpstreamThrottled, is_throttle_status, parse_retry_after, \
+    retry_with_backoff
+from utils.single_flight import SingleFlight
+from utils.ttl_cache import TTLCache
+
 API_TOKEN = os.getenv("API_TOKEN")
 CURRENCY = "rub"
 ONE_WAY = "true"
 DIRECT = "false"
-async def get_price_for_date(origin: str, destination: str, date_str: str):
-    url = "https://api.travelpayouts.com/aviasales/v3/prices_for_dates"
+PRICES_URL = "https://api.travelpayouts.com/aviasales/v3/prices_for_dates"
+
+# Одновременные одинаковые запросы (маршрут/дата/валюта/опции) делят один вызов API
+_price_flights = SingleFlight()
+
+# Кэш цен: свежие ответы живут PRICE_CACHE_TTL секунд, устаревшие ещё
+# PRICE_CACHE_STALE_TTL секунд отдаются в режиме stale-while-revalidate.
+# PRICE_CACHE_REDIS=1 — разделять кэш между процессами через Redis.
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "90"))
+PRICE_CACHE_STALE_TTL = float(os.getenv("PRICE_CACHE_STALE_TTL", "600"))
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "20000"))
+PRICE_CACHE_MAX_BYTES = int(os.getenv("PRICE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+PRICE_CACHE_REDIS = os.getenv("PRICE_CACHE_REDIS", "0") == "1"
+
+_price_cache = TTLCache(
+    ttl=PRICE_CACHE_TTL,
+    stale_ttl=PRICE_CACHE_STALE_TTL,
+    max_entries=PRICE_CACHE_MAX_ENTRIES,
+    max_bytes=PRICE_CACHE_MAX_BYTES,
+    redis_prefix="price" if PRICE_CACHE_REDIS else None,
+)
+_refresh_tasks = set()
+
+# Параметры общего HTTP-пула (секунды / количество соединений)
+AVIASALES_TIMEOUT = float(os.getenv("AVIASALES_TIMEOUT", "15"))
+AVIASALES_CONNECT_TIMEOUT = float(os.getenv("AVIASALES_CONNECT_TIMEOUT", "5"))
+AVIASALES_CONN_LIMIT = int(os.getenv("AVIASALES_CONN_LIMIT", "100"))
+AVIASALES_CONN_LIMIT_PER_HOST = int(os.getenv("AVIASALES_CONN_LIMIT_PER_HOST", "20"))
+AVIASALES_KEEPALIVE = float(os.getenv("AVIASALES_KEEPALIVE", "60"))
+AVIASALES_DNS_TTL = int(os.getenv("AVIASALES_DNS_TTL", "300"))
+
+# Общий лимит запросов к Travelpayouts: AVIASALES_RATE запросов/с, всплеск до AVIASALES_BURST.
+# При 429/5xx скорость снижается и восстанавливается постепенно.
+AVIASALES_RATE = float(os.getenv("AVIASALES_RATE", "5"))
+AVIASALES_BURST = float(os.getenv("AVIASALES_BURST", "10"))
+AVIASALES_RETRIES = int(os.getenv("AVIASALES_RETRIES", "3"))
+# Квота Travelpayouts — на токен, а не на процесс: bucket общий для всех воркеров (через Redis)
+aviasales_limiter = SharedTokenBucket(AVIASALES_RATE, AVIASALES_BURST, name="aviasales")
+
+# PRICE_BATCH_MONTH=1: цены запрашиваются сразу за месяц (один запрос на маршрут и месяц),
+# а ответ раздаётся всем датам этого месяца. Если выборка упёрлась в MONTH_BATCH_LIMIT
+# и нужной даты в ней нет — дата запрашивается отдельно.
+PRICE_BATCH_MONTH = os.getenv("PRICE_BATCH_MONTH", "1") == "1"
+MONTH_BATCH_LIMIT = 1000
+
+_session = None  # type: Optional[aiohttp.ClientSession]
+
+
+async def init_session() -> aiohttp.ClientSession:
+    """Возвращает общую сессию Aviasales, создавая её при первом обращении.
+
+    Сессия живёт всё время работы бота: соединения, TLS и DNS переиспользуются
+    между опросами. Закрывается через close_session() при остановке.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+
+    connector = aiohttp.TCPConnector(
+        limit=AVIASALES_CONN_LIMIT,
+        limit_per_host=AVIASALES_CONN_LIMIT_PER_HOST,
+        keepalive_timeout=AVIASALES_KEEPALIVE,
+        ttl_dns_cache=AVIASALES_DNS_TTL,
+        use_dns_cache=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=AVIASALES_TIMEOUT,
+        connect=AVIASALES_CONNECT_TIMEOUT,
+    )
+    _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        try:
+            await _session.close()
+        except Exception:
+            pass
+        _session = None
+
+
+def price_key(origin: str, destination: str, date_str: str,
+              currency: str = CURRENCY, direct: str = DIRECT, one_way: str = ONE_WAY) -> tuple:
+    return (origin.upper(), destination.upper(), date_str, currency, direct, one_way)
+
+
+def batch_key(origin: str, destination: str, date_str: str,
+              currency: str = CURRENCY, direct: str = DIRECT, one_way: str = ONE_WAY) -> tuple:
+    """Ключ одного запроса к API, которым обслуживается дата: месяц в пакетном режиме, иначе сама дата."""
+    period = date_str[:7] if PRICE_BATCH_MONTH else date_str
+    return price_key(origin, destination, period, currency, direct, one_way)
+
+
+async def get_price_for_date(origin: str, destination: str, date_str: str,
+                             currency: str = CURRENCY, direct: str = DIRECT, one_way: str = ONE_WAY,
+                             allow_stale: bool = False):
+    """Самый дешёвый билет на дату (dict), None — если рейсов нет, {"error": ...} — ошибка API.
+
+    При `allow_stale=True` устаревший ответ из кэша возвращается сразу,
+    а обновление запускается в фоне.
+    """
+    flight, _ = await fetch_price_for_date(origin, destination, date_str, currency, direct, one_way,
+                                           allow_stale=allow_stale)
+    return flight
+
+
+async def fetch_price_for_date(origin: str, destination: str, date_str: str,
+                               currency: str = CURRENCY, direct: str = DIRECT, one_way: str = ONE_WAY,
+                               allow_stale: bool = False, max_age: Optional[float] = None):
+    """Как get_price_for_date, но возвращает (flight, from_cache).
+
+    `max_age` — ответ из кэша старше стольких секунд считается устаревшим, даже если
+    PRICE_CACHE_TTL ещё не истёк (планировщик так не получает обратно свой же прошлый ответ).
+    """
+    if PRICE_BATCH_MONTH:
+        month_key = price_key(origin, destination, date_str[:7], currency, direct, one_way)
+        month, cached = await _get_cached(month_key, _fetch_prices_for_month, allow_stale, max_age)
+        if isinstance(month, dict) and "by_date" in month:
+            flight = month["by_date"].get(date_str)
+            if flight is not None or month.get("complete"):
+                return flight, cached
+        elif month is not None:
+            return month, cached
+
+    key = price_key(origin, destination, date_str, currency, direct, one_way)
+    return await _get_cached(key, _fetch_price_for_date, allow_stale, max_age)
+
+
+def get_price_stats() -> dict:
+    """Сколько обращений дошло до API и сколько записей в кэше."""
+    stats = _price_flights.stats()
+    stats.update({f"cache_{k}": v for k, v in _price_cache.stats().items()})
+    return stats
+
+
+async def _get_cached(key: tuple, fetch: Callable[..., Awaitable[Any]], allow_stale: bool,
+                      max_age: Optional[float] = None) -> Tuple[Any, bool]:
+    """(значение, взято ли оно из кэша)."""
+    entry = await _price_cache.get_entry(key)
+    if entry is not None:
+        value, age, ttl = entry
+        if max_age is not None:
+            ttl = min(ttl, max_age)
+        if age < ttl:
+            return value, True
+        if allow_stale:
+            _refresh_in_background(key, fetch)
+            return value, True
+    try:
+        return await _price_flights.do(key, lambda: _fetch_and_cache(key, fetch)), False
+    except Exception as e:
+        print(f"Ошибка при получении данных: {e}")
+        return None, False
+
+
+async def _fetch_and_cache(key: tuple, fetch: Callable[..., Awaitable[Any]]):
+    result = await retry_with_backoff(lambda: fetch(*key), attempts=AVIASALES_RETRIES)
+    # Ошибки API не кэшируем: они бывают временными (квоты, сбои)
+    if not (isinstance(result, dict) and result.get("error")):
+        await _price_cache.set(key, result)
+    return result
+
+
+def _refresh_in_background(key: tuple, fetch: Callable[..., Awaitable[Any]]):
+    async def _refresh():
+        try:
+            await _price_flights.do(key, lambda: _fetch_and_cache(key, fetch))
+        except Exception as e:
+            print(f"Ошибка фонового обновления цены {key}: {e}")
+
+    task = asyncio.create_task(_refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _fetch_price_for_date(origin: str, destination: str, date_str: str,
+                                currency: str, direct: str, one_way: str):
+    flights = await _request_prices(origin, destination, date_str, currency, direct, one_way, limit=10)
+    if isinstance(flights, dict):
+        return flights
+    return flights[0] if flights else None
+
+
+async def _fetch_prices_for_month(origin: str, destination: str, month: str,
+                                  currency: str, direct: str, one_way: str):
+    """Самые дешёвые билеты по каждой дате месяца: {"by_date": {date: flight}, "complete": bool}."""
+    flights = await _request_prices(origin, destination, month, currency, direct, one_way,
+                                    limit=MONTH_BATCH_LIMIT)
+    if isinstance(flights, dict):
+        return flights
+    by_date = {}
+    # Ответ отсортирован по цене — первый билет на дату и есть самый дешёвый
+    for flight in flights:
+        date = str(flight.get("departure_at", ""))[:10]
+        if date and date not in by_date:
+            by_date[date] = flight
+    return {"by_date": by_date, "complete": len(flights) < MONTH_BATCH_LIMIT}
+
+
+async def _request_prices(origin: str, destination: str, departure_at: str,
+                          currency: str, direct: str, one_way: str, limit: int):
+    """Список билетов по возрастанию цены или {"error": "api_error"}."""
     params = {
         "origin": origin,
         "destination": destination,
-        "departure_at": date_str,
+        "departure_at": departure_at,
         "token": API_TOKEN,
-        "cy": CURRENCY,
-        "one_way": ONE_WAY,
-        "direct": DIRECT,
-        "limit": 10,
+        "cy": currency,
+        "one_way": one_way,
+        "direct": direct,
+        "limit": limit,
         "page": 1,
         "sorting": "price",
         "unique": "false"
     }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                data = await response.json()
-                if not data.get("success", False):
-                    return {"error": "api_error"}
-
-                flights = data.get("data", [])
-                return flights[0] if flights else None
-    except Exception as e:
-        print(f"Ошибка при получении данных: {e}")
-        return None
+    await aviasales_limiter.acquire()
+    session = await init_session()
+    async with session.get(PRICES_URL, params=params) as response:
+        if is_throttle_status(response.status):
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            aviasales_limiter.on_throttle(retry_after)
+            raise UpstreamThrottled(response.status, retry_after)
+        aviasales_limiter.on_success()
+        data = await response.json()
+        if not data.get("success", False):
+            return {"error": "api_error"}
 
+        return data.get("data", []) or []
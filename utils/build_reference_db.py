@@ -0,0 +1,62 @@
+"""Сборка справочника ICAO в SQLite-файл.
+
+Словари utils/airport_icao.py и utils/airlines_icao.py остаются исходником данных,
+а бот читает собранный файл через utils/reference_store.py.
+
+Запуск: python -m utils.build_reference_db [путь]  (по умолчанию REFERENCE_DB_PATH)
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+
+from utils.reference_store import REFERENCE_DB_PATH
+
+
+def build_reference_db(path: str = REFERENCE_DB_PATH) -> str:
+    """Собирает файл справочника и возвращает его версию (хэш содержимого)."""
+    from utils.airport_icao import airport_icao
+    from utils.airlines_icao import airlines_icao
+
+    airports = sorted(
+        (str(code).upper(), city or "", name or "")
+        for code, (city, name) in airport_icao.items()
+    )
+    airlines = sorted(
+        (str(code).upper(), name or "", country or "")
+        for code, (name, country) in airlines_icao.items()
+    )
+    digest = hashlib.sha1()
+    for row in airports + airlines:
+        digest.update("\x1f".join(row).encode("utf-8"))
+        digest.update(b"\x1e")
+    version = digest.hexdigest()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA page_size = 4096")
+        # WITHOUT ROWID: строка хранится прямо в B-дереве первичного ключа — поиск одним проходом
+        conn.execute("CREATE TABLE airports (code TEXT PRIMARY KEY, city TEXT NOT NULL, name TEXT NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE TABLE airlines (code TEXT PRIMARY KEY, name TEXT NOT NULL, country TEXT NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+        conn.executemany("INSERT OR REPLACE INTO airports VALUES (?, ?, ?)", airports)
+        conn.executemany("INSERT OR REPLACE INTO airlines VALUES (?, ?, ?)", airlines)
+        conn.execute("INSERT INTO meta VALUES ('version', ?)", (version,))
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    # Атомарная замена: работающие процессы дочитают старый файл
+    os.replace(tmp_path, path)
+    return version
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else REFERENCE_DB_PATH
+    built_version = build_reference_db(target)
+    print(f"Справочник ICAO собран: {target} (версия {built_version[:12]})")
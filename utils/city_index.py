@@ -0,0 +1,153 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Разные дефисы/тире и неразрывный пробел приводим к обычному пробелу
+_NORMALIZE_TABLE = str.maketrans({
+    "\u2011": " ", "\u2013": " ", "\u2014": " ", "\u2212": " ", "-": " ", "\u00a0": " ",
+    "ё": "е",
+})
+
+_TRANSLIT_TABLE = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p",
+    "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch",
+    "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+
+# Привычные латинские написания, которые не совпадают с транслитерацией
+CITY_ALIASES: Dict[str, List[str]] = {
+    "москва": ["moscow"],
+    "санкт петербург": ["saint petersburg", "st petersburg", "petersburg"],
+    "нижний новгород": ["nizhny novgorod"],
+    "екатеринбург": ["yekaterinburg", "ekaterinburg"],
+    "петропавловск камчатский": ["petropavlovsk kamchatsky"],
+    "грозный": ["grozny"],
+    "чикаго": ["chicago"],
+    "париж": ["paris"],
+    "пекин": ["beijing"],
+    "токио": ["tokyo"],
+    "сеул": ["seoul"],
+    "дели": ["delhi", "new delhi"],
+    "дубай": ["dubai"],
+    "гонконг": ["hong kong"],
+    "шанхай": ["shanghai"],
+    "сингапур": ["singapore"],
+    "сидней": ["sydney"],
+    "мельбурн": ["melbourne"],
+    "нью йорк": ["new york"],
+    "лос анджелес": ["los angeles"],
+    "каир": ["cairo"],
+    "йоханнесбург": ["johannesburg"],
+    "кейп таун": ["cape town"],
+    "аддис абеба": ["addis ababa"],
+    "буэнос айрес": ["buenos aires"],
+    "сан паулу": ["sao paulo"],
+    "сантьяго": ["santiago"],
+}
+
+
+def normalize_text(value: str) -> str:
+    s = (value or "").strip().lower().translate(_NORMALIZE_TABLE)
+    return " ".join(s.split())
+
+
+def transliterate(value: str) -> str:
+    """Кириллица → латиница (упрощённая схема); уже нормализованная строка."""
+    return value.translate(_TRANSLIT_TABLE)
+
+
+class _PrefixTable:
+    """Отсортированный массив ключей с номерами записей: поиск за O(log n + k)."""
+
+    def __init__(self, postings: Dict[str, List[int]]):
+        self.keys: List[str] = sorted(postings)
+        self.postings: List[List[int]] = [postings[k] for k in self.keys]
+        self.by_key: Dict[str, List[int]] = postings
+
+    def collect(self, query: str, found: set):
+        # Города, начинающиеся с запроса
+        pos = bisect_left(self.keys, query)
+        while pos < len(self.keys) and self.keys[pos].startswith(query):
+            found.update(self.postings[pos])
+            pos += 1
+        # Города, с названия которых начинается запрос ("москва шереметьево")
+        for end in range(1, len(query)):
+            hit = self.by_key.get(query[:end])
+            if hit:
+                found.update(hit)
+
+
+class CityIndex:
+    """Поисковый индекс по названиям городов, строится один раз.
+
+    Хранит отсортированные массивы нормализованных ключей, поэтому поиск
+    по префиксу — бинарный поиск и проход по k совпадениям. Сохраняет правило
+    прежнего поиска: город начинается с запроса или запрос начинается с названия города.
+
+    Латинский запрос ищется ещё и по транслитерации/алиасам кириллических названий
+    ("moskva", "Moscow" → Москва), кириллический — ещё и в транслитерации
+    (для справочников с латинскими названиями, как ICAO).
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str]],
+                 aliases: Optional[Dict[str, List[str]]] = None):
+        """`entries` — тройки (code, city, label)."""
+        aliases = CITY_ALIASES if aliases is None else aliases
+        self._entries: List[Tuple[str, str]] = []
+        native: Dict[str, List[int]] = {}
+        latin: Dict[str, List[int]] = {}
+        for code, city, label in entries:
+            idx = len(self._entries)
+            self._entries.append((code, label))
+            city_norm = normalize_text(city)
+            if not city_norm:
+                continue
+            native.setdefault(city_norm, []).append(idx)
+            if has_cyrillic(city_norm):
+                keys = {transliterate(city_norm)}
+                keys.update(normalize_text(a) for a in aliases.get(city_norm, ()))
+                for key in keys:
+                    latin.setdefault(key, []).append(idx)
+
+        self._native = _PrefixTable(native)
+        self._latin = _PrefixTable(latin)
+        # Порядок выдачи — по нормализованной подписи, как раньше
+        order = sorted(range(len(self._entries)), key=lambda i: normalize_text(self._entries[i][1]))
+        self._rank: List[int] = [0] * len(self._entries)
+        for rank, idx in enumerate(order):
+            self._rank[idx] = rank
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def search(self, query: str) -> List[Tuple[str, str]]:
+        """Возвращает [(code, label)] для запроса на кириллице или латинице."""
+        q = normalize_text(query)
+        if not q:
+            return []
+        found = set()
+        self._native.collect(q, found)
+        if has_cyrillic(q):
+            self._native.collect(transliterate(q), found)
+        else:
+            self._latin.collect(q, found)
+        return [self._entries[i] for i in sorted(found, key=self._rank.__getitem__)]
+
+
+def has_cyrillic(value: str) -> bool:
+    return any("а" <= ch <= "я" or ch == "ё" for ch in value)
+
+
+_icao_city_index = None  # type: Optional[CityIndex]
+
+
+def get_icao_city_index() -> CityIndex:
+    """Тот же индекс по справочнику ICAO (строится при первом обращении)."""
+    global _icao_city_index
+    if _icao_city_index is None:
+        from utils.reference_store import iter_airports
+        _icao_city_index = CityIndex(
+            (code, city, f"{city} ({name})" if city else name)
+            for code, (city, name) in iter_airports()
+        )
+    return _icao_city_index
@@ -0,0 +1,76 @@
+"""Генератор фейковых апдейтов Telegram для локальной проверки webhook-режима.
+
+Запуск (бот с UPDATES_MODE=webhook уже слушает порт):
+    python -m utils.fake_updates --count 2000 --concurrency 50 --secret "$WEBHOOK_SECRET"
+
+Шлёт сообщения от случайных пользователей (/start, /help, кнопки меню) и печатает
+распределение кодов ответа и задержки. Ответы бота уйдут в настоящий Bot API
+и для выдуманных chat_id завершатся ошибкой — это ожидаемо: проверяется приём
+и обработка апдейтов, а не доставка.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+
+import aiohttp
+
+from utils.webhook import SECRET_HEADER, WEBHOOK_PATH, WEBHOOK_PORT
+
+TEXTS = ["/start", "/help", "📋 Мои отслеживания", "Поиск авиабилетов", "/track LED KGD 08-09-2030 7000"]
+
+
+def fake_update(update_id: int) -> dict:
+    user_id = random.randint(10_000_000, 99_999_999)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test", "username": f"user{user_id}"},
+            "text": random.choice(TEXTS),
+        },
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    headers = {SECRET_HEADER: args.secret} if args.secret else {}
+    statuses = Counter()
+    latencies = []
+    ids = iter(range(1, args.count + 1))
+
+    async def sender(session: aiohttp.ClientSession):
+        for update_id in ids:
+            started = time.perf_counter()
+            try:
+                async with session.post(args.url, json=fake_update(update_id), headers=headers) as resp:
+                    statuses[resp.status] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(max(1, args.concurrency))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Отправлено {args.count} апдейтов за {elapsed:.2f} с ({args.count / elapsed:.0f}/с)")
+    print(f"Коды ответа: {dict(statuses)}")
+    if latencies:
+        print(f"Задержка: медиана {statistics.median(latencies):.1f} мс, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} мс, макс {latencies[-1]:.1f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,170 +1,306 @@
 import os
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional, List
+from typing import Any, Callable, Dict, Optional, List
 from fr24sdk.client import Client
-from utils.airport_icao import get_airport_city_name_by_icao
-
-async def get_flight_status_by_number(flight_number: str) -> Optional[Dict[str, Any]]:
+from utils.icao_lookup import resolve_icao_codes
+from utils.rate_limiter import SharedTokenBucket, UpstreamThrottled, retry_with_backoff, throttled_from_exception
+from utils.single_flight import SingleFlight
+from utils.ttl_cache import TTLCache
+
+# Общий лимит запросов к FR24 (запросов/с и всплеск), повторы при 429/5xx
+FR24_RATE = float(os.getenv("FR24_RATE", "1"))
+FR24_BURST = float(os.getenv("FR24_BURST", "4"))
+FR24_RETRIES = int(os.getenv("FR24_RETRIES", "3"))
+fr24_limiter = SharedTokenBucket(FR24_RATE, FR24_BURST, name="fr24")
+
+# Свой ограниченный пул потоков для SDK, чтобы не занимать пул по умолчанию
+FR24_MAX_WORKERS = int(os.getenv("FR24_MAX_WORKERS", "8"))
+
+# Кэш ответов по (номер рейса, окно): статус живёт недолго, история из завершённых
+# рейсов — дольше, так как уже состоявшиеся перелёты не меняются
+FR24_STATUS_TTL = float(os.getenv("FR24_STATUS_TTL", "60"))
+FR24_HISTORY_TTL = float(os.getenv("FR24_HISTORY_TTL", "1800"))
+FR24_HISTORY_ACTIVE_TTL = float(os.getenv("FR24_HISTORY_ACTIVE_TTL", "180"))
+FR24_CACHE_MAX_ENTRIES = int(os.getenv("FR24_CACHE_MAX_ENTRIES", "5000"))
+
+_fr24_cache = TTLCache(ttl=FR24_STATUS_TTL, max_entries=FR24_CACHE_MAX_ENTRIES)
+_fr24_flights = SingleFlight()
+
+_executor = None  # type: Optional[ThreadPoolExecutor]
+_client = None  # type: Optional[Client]
+_client_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=FR24_MAX_WORKERS, thread_name_prefix="fr24")
+    return _executor
+
+
+def _get_client() -> Client:
+    """Общий клиент SDK: HTTP-соединения переиспользуются между запросами."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client(api_token=os.getenv("FR24_API_KEY"))
+        return _client
+
+
+def close_fr24_client():
+    global _executor, _client
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    with _client_lock:
+        if _client is not None:
+            try:
+                _client.close()
+            except Exception:
+                pass
+            _client = None
+
+
+async def _sdk_call(fn: Callable[[Client], Any]) -> Any:
+    """Один запрос к FR24 через общий клиент в пуле потоков с учётом общего лимита.
+
+    При 429/5xx скорость лимитера снижается, а запрос повторяется с джиттером.
+    Если повторы не помогли или запрос завершился другой ошибкой — None.
+    """
     loop = asyncio.get_running_loop()
 
-    def _call_sdk() -> Optional[Dict[str, Any]]:
+    def _call() -> Any:
         try:
-            now = datetime.now(timezone.utc)
-            dt_from = now - timedelta(hours=18)
-            dt_to = now + timedelta(hours=18)
+            return fn(_get_client())
+        except Exception as e:
+            throttled = throttled_from_exception(e)
+            if throttled is not None:
+                raise throttled from e
+            return None
 
-            # Хелперы для безопасного доступа к полям (dict/attr) и преобразования дат
-            def safe_get(obj: Any, key: str, default: Any = "") -> Any:
-                try:
-                    if obj is None:
-                        return default
-                    if isinstance(obj, dict):
-                        return obj.get(key, default)
-                    return getattr(obj, key, default)
-                except Exception:
-                    return default
+    async def _attempt():
+        await fr24_limiter.acquire()
+        try:
+            result = await loop.run_in_executor(_get_executor(), _call)
+        except UpstreamThrottled as e:
+            fr24_limiter.on_throttle(e.retry_after)
+            raise
+        fr24_limiter.on_success()
+        return result
+
+    try:
+        return await retry_with_backoff(_attempt, attempts=FR24_RETRIES)
+    except UpstreamThrottled as e:
+        print(f"FR24 ограничил запросы: {e}")
+        return None
+
+
+# Хелперы для безопасного доступа к полям (dict/attr) и преобразования дат
+def _safe_get(obj: Any, key: str, default: Any = "") -> Any:
+    try:
+        if obj is None:
+            return default
+        if isinstance(obj, dict):
+            return obj.get(key, default)
+        return getattr(obj, key, default)
+    except Exception:
+        return default
+
+
+def _to_str(dt: Any) -> str:
+    try:
+        if dt is None:
+            return ""
+        if isinstance(dt, datetime):
+            return dt.isoformat()
+        return str(dt)
+    except Exception:
+        return ""
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        if value is None or value == "":
+            return None
+        return float(value)
+    except Exception:
+        return None
 
-            def to_str(dt: Any) -> str:
-                try:
-                    if dt is None:
-                        return ""
-                    if isinstance(dt, datetime):
-                        return dt.isoformat()
-                    return str(dt)
-                except Exception:
-                    return ""
 
-            def to_float(value: Any) -> Optional[float]:
-                try:
-                    if value is None or value == "":
-                        return None
-                    return float(value)
-                except Exception:
-                    return None
+def _parse_iso(value: Any) -> Optional[datetime]:
+    try:
+        s = _to_str(value)
+        if not s:
+            return None
+        if s.endswith("Z"):
+            s = s[:-1] + "+00:00"
+        return datetime.fromisoformat(s)
+    except Exception:
+        return None
 
-            with Client(api_token=os.getenv("FR24_API_KEY")) as client:
-                # 1) Проверяем активную позицию рейса
-                try:
-                    live_resp = client.live.flight_positions.get_light(flights=[flight_number])
-                except Exception:
-                    live_resp = None
-
-                live_data = getattr(live_resp, "data", None)
-                if live_data is None and isinstance(live_resp, dict):
-                    live_data = live_resp.get("data")
-
-                active_callsign = None
-                lat_value = None
-                lon_value = None
-                if isinstance(live_data, list) and len(live_data) > 0:
-                    first = live_data[0]
-                    active_callsign = safe_get(first, "callsign") or None
-                    lat_value = to_float(
-                        safe_get(first, "lat", None)
-                        or safe_get(first, "latitude", None)
-                    )
-                    lon_value = to_float(
-                        safe_get(first, "lon", None)
-                        or safe_get(first, "lng", None)
-                        or safe_get(first, "longitude", None)
-                    )
-
-                # 2) Получаем сводку рейса
-                try:
-                    date_from_str = dt_from.strftime("%Y-%m-%d")
-                    date_to_str = dt_to.strftime("%Y-%m-%d")
-
-                    summary = client.flight_summary.get_light(
-                        flights=[flight_number],
-                        flight_datetime_from=date_from_str,
-                        flight_datetime_to=date_to_str,
-                    )
-                except Exception:
-                    summary = None
-
-                summary_data = getattr(summary, "data", None)
-                if summary_data is None and isinstance(summary, dict):
-                    summary_data = summary.get("data")
-
-                if isinstance(summary_data, list) and len(summary_data) > 0:
-                    item = summary_data[-1]
-
-                    dep_code = safe_get(item, "orig_icao", "")
-                    arr_code = safe_get(item, "dest_icao_actual", "") or safe_get(item, "dest_icao", "")
-
-                    scheduled_dep = to_str(safe_get(item, "first_seen", None))
-                    estimated_dep = to_str(safe_get(item, "datetime_takeoff", None))
-                    scheduled_arr = to_str(safe_get(item, "last_seen", None))
-                    estimated_arr = to_str(safe_get(item, "datetime_landed", None))
-
-                    flight_ended = bool(safe_get(item, "flight_ended", False))
-                    status = "scheduled"
-                    if active_callsign:
-                        status = "active"
-                    elif flight_ended or (estimated_arr and estimated_arr <= now.isoformat()):
-                        status = "landed"
-                    elif estimated_dep or scheduled_dep:
-                        # если взлетел, но еще не закончен
-                        if estimated_dep and (not estimated_arr):
-                            status = "departed"
-                        else:
-                            # по времени относительно now
-                            latest_dep = estimated_dep or scheduled_dep
-                            if latest_dep and latest_dep <= now.isoformat():
-                                status = "departed"
-
-                    airline_name = safe_get(item, "operating_as", "") or safe_get(item, "painted_as", "")
-                    number_field = safe_get(item, "flight", "") or safe_get(item, "callsign", "")
-                    number_final = number_field or active_callsign or flight_number
-
-                    # Определяем город и название аэропортов по ICAO
-                    dep_city, dep_name = get_airport_city_name_by_icao(dep_code)
-                    arr_city, arr_name = get_airport_city_name_by_icao(arr_code)
-
-                    result: Dict[str, Any] = {
-                        "status": status,
-                        "flight": {
-                            "flight_number": number_final,
-                            "departure": {
-                                "city": dep_city,
-                                "name": dep_name,
-                                "scheduled": scheduled_dep,
-                                "estimated": estimated_dep,
-                            },
-                            "arrival": {
-                                "city": arr_city,
-                                "name": arr_name,
-                                "scheduled": scheduled_arr,
-                                "estimated": estimated_arr,
-                            },
-                            "airline": airline_name,
-                        },
-                    }
-                    if lat_value is not None and lon_value is not None:
-                        result["position"] = {"lat": lat_value, "lon": lon_value}
-                    return result
-
-                # если сводки нет, но есть активная позиция — вернем базовую информацию
-                if active_callsign:
-                    result: Dict[str, Any] = {
-                        "status": "active",
-                        "flight": {
-                            "flight_number": active_callsign or flight_number,
-                            "departure": {"city": "", "name": "", "scheduled": "", "estimated": ""},
-                            "arrival": {"city": "", "name": "", "scheduled": "", "estimated": ""},
-                            "airline": "",
-                        },
-                    }
-                    if lat_value is not None and lon_value is not None:
-                        result["position"] = {"lat": lat_value, "lon": lon_value}
-                    return result
 
-            return None
-        except Exception:
-            return None
+def _response_data(resp: Any) -> Any:
+    data = getattr(resp, "data", None)
+    if data is None and isinstance(resp, dict):
+        data = resp.get("data")
+    return data
+
+
+def get_fr24_cache_stats() -> dict:
+    """Попадания/промахи кэша FR24 и число реальных обращений к API."""
+    stats = _fr24_cache.stats()
+    stats.update({f"requests_{k}": v for k, v in _fr24_flights.stats().items()})
+    return stats
 
-    return await loop.run_in_executor(None, _call_sdk)
+
+async def _cached(key: tuple, load: Callable[[], Any], ttl_for: Callable[[Any], float]) -> Any:
+    """Читает из кэша или загружает (одна загрузка на ключ); None не кэшируется."""
+    value = await _fr24_cache.get(key)
+    if value is not None:
+        return value
+
+    async def _load_and_store():
+        result = await load()
+        if result is not None:
+            await _fr24_cache.set(key, result, ttl=ttl_for(result))
+        return result
+
+    return await _fr24_flights.do(key, _load_and_store)
+
+
+async def get_flight_status_by_number(flight_number: str) -> Optional[Dict[str, Any]]:
+    now = datetime.now(timezone.utc)
+    dt_from = now - timedelta(hours=18)
+    dt_to = now + timedelta(hours=18)
+    date_from_str = dt_from.strftime("%Y-%m-%d")
+    date_to_str = dt_to.strftime("%Y-%m-%d")
+
+    key = ("status", flight_number, date_from_str, date_to_str)
+    return await _cached(
+        key,
+        lambda: _load_status(flight_number, now, date_from_str, date_to_str),
+        lambda _: FR24_STATUS_TTL,
+    )
+
+
+async def _load_status(flight_number: str, now: datetime, date_from_str: str,
+                       date_to_str: str) -> Optional[Dict[str, Any]]:
+    # 1) активная позиция рейса и 2) сводка рейса — запрашиваются одновременно
+    live_resp, summary = await asyncio.gather(
+        _sdk_call(lambda client: client.live.flight_positions.get_light(flights=[flight_number])),
+        _sdk_call(lambda client: client.flight_summary.get_light(
+            flights=[flight_number],
+            flight_datetime_from=date_from_str,
+            flight_datetime_to=date_to_str,
+        )),
+    )
+
+    result = _build_status(flight_number, now, live_resp, summary)
+    if result is not None:
+        await _fill_reference_data([result["flight"]])
+    return result
+
+
+def _build_status(flight_number: str, now: datetime, live_resp: Any, summary: Any) -> Optional[Dict[str, Any]]:
+    try:
+        live_data = _response_data(live_resp)
+
+        active_callsign = None
+        lat_value = None
+        lon_value = None
+        if isinstance(live_data, list) and len(live_data) > 0:
+            first = live_data[0]
+            active_callsign = _safe_get(first, "callsign") or None
+            lat_value = _to_float(
+                _safe_get(first, "lat", None)
+                or _safe_get(first, "latitude", None)
+            )
+            lon_value = _to_float(
+                _safe_get(first, "lon", None)
+                or _safe_get(first, "lng", None)
+                or _safe_get(first, "longitude", None)
+            )
+
+        summary_data = _response_data(summary)
+
+        if isinstance(summary_data, list) and len(summary_data) > 0:
+            item = summary_data[-1]
+
+            dep_code = _safe_get(item, "orig_icao", "")
+            arr_code = _safe_get(item, "dest_icao_actual", "") or _safe_get(item, "dest_icao", "")
+
+            scheduled_dep = _to_str(_safe_get(item, "first_seen", None))
+            estimated_dep = _to_str(_safe_get(item, "datetime_takeoff", None))
+            scheduled_arr = _to_str(_safe_get(item, "last_seen", None))
+            estimated_arr = _to_str(_safe_get(item, "datetime_landed", None))
+
+            flight_ended = bool(_safe_get(item, "flight_ended", False))
+            status = "scheduled"
+            if active_callsign:
+                status = "active"
+            elif flight_ended or (estimated_arr and estimated_arr <= now.isoformat()):
+                status = "landed"
+            elif estimated_dep or scheduled_dep:
+                # если взлетел, но еще не закончен
+                if estimated_dep and (not estimated_arr):
+                    status = "departed"
+                else:
+                    # по времени относительно now
+                    latest_dep = estimated_dep or scheduled_dep
+                    if latest_dep and latest_dep <= now.isoformat():
+                        status = "departed"
+
+            airline_name = _safe_get(item, "operating_as", "") or _safe_get(item, "painted_as", "")
+            number_field = _safe_get(item, "flight", "") or _safe_get(item, "callsign", "")
+            number_final = number_field or active_callsign or flight_number
+
+            # Город и название аэропортов по ICAO заполняет _fill_reference_data
+            result: Dict[str, Any] = {
+                "status": status,
+                "flight": {
+                    "flight_number": number_final,
+                    "departure": {
+                        "icao": dep_code,
+                        "city": "",
+                        "name": "",
+                        "scheduled": scheduled_dep,
+                        "estimated": estimated_dep,
+                    },
+                    "arrival": {
+                        "icao": arr_code,
+                        "city": "",
+                        "name": "",
+                        "scheduled": scheduled_arr,
+                        "estimated": estimated_arr,
+                    },
+                    "airline": airline_name,
+                },
+            }
+            if lat_value is not None and lon_value is not None:
+                result["position"] = {"lat": lat_value, "lon": lon_value}
+            return result
+
+        # если сводки нет, но есть активная позиция — вернем базовую информацию
+        if active_callsign:
+            result: Dict[str, Any] = {
+                "status": "active",
+                "flight": {
+                    "flight_number": active_callsign or flight_number,
+                    "departure": {"city": "", "name": "", "scheduled": "", "estimated": ""},
+                    "arrival": {"city": "", "name": "", "scheduled": "", "estimated": ""},
+                    "airline": "",
+                },
+            }
+            if lat_value is not None and lon_value is not None:
+                result["position"] = {"lat": lat_value, "lon": lon_value}
+            return result
+
+        return None
+    except Exception:
+        return None
 
 
 async def get_flight_history_by_number(flight_number: str, days: int = 14) -> Optional[List[Dict[str, Any]]]:
@@ -173,151 +309,162 @@ async def get_flight_history_by_number(flight_number: str, days: int = 14) -> Op
     Каждый элемент списка содержит информацию о вылете/прилёте, статус, аэропорты (по ICAO),
     времена в ISO-строках, авиакомпанию и финальный номер рейса (если был callsign).
     """
-    loop = asyncio.get_running_loop()
-
-    def _call_sdk_hist() -> Optional[List[Dict[str, Any]]]:
-        try:
-            now = datetime.now(timezone.utc)
-            dt_from = now - timedelta(days=max(1, int(days)))
-            date_from_str = dt_from.strftime("%Y-%m-%d")
-            date_to_str = now.strftime("%Y-%m-%d")
-
-            def safe_get(obj: Any, key: str, default: Any = "") -> Any:
+    try:
+        now = datetime.now(timezone.utc)
+        dt_from = now - timedelta(days=max(1, int(days)))
+    except Exception:
+        return None
+    date_from_str = dt_from.strftime("%Y-%m-%d")
+    date_to_str = now.strftime("%Y-%m-%d")
+
+    key = ("history", flight_number, date_from_str, date_to_str)
+    return await _cached(
+        key,
+        lambda: _load_history(flight_number, date_from_str, date_to_str),
+        _history_ttl,
+    )
+
+
+def _history_ttl(history: List[Dict[str, Any]]) -> float:
+    # Пока хоть один рейс в окне не приземлился, история может измениться
+    if history and all((item.get("arrival") or {}).get("actual") for item in history):
+        return FR24_HISTORY_TTL
+    return FR24_HISTORY_ACTIVE_TTL
+
+
+async def _load_history(flight_number: str, date_from_str: str,
+                        date_to_str: str) -> Optional[List[Dict[str, Any]]]:
+    summary = await _sdk_call(lambda client: client.flight_summary.get_light(
+        flights=[flight_number],
+        flight_datetime_from=date_from_str,
+        flight_datetime_to=date_to_str,
+    ))
+    if summary is None:
+        # Ошибка FR24 — не кэшируем пустую историю, следующий запрос повторит попытку
+        return None
+
+    history = _build_history(flight_number, summary)
+    if history:
+        await _fill_reference_data(history)
+    return history
+
+
+def _looks_like_airline_icao(value: Any) -> bool:
+    code = str(value or "").strip()
+    return len(code) == 3 and code.isalpha()
+
+
+async def _fill_reference_data(items: List[Dict[str, Any]]):
+    """Подставляет города/названия аэропортов и авиакомпании по ICAO — одним запросом на весь ответ."""
+    airports = [
+        item[leg].get("icao") for item in items for leg in ("departure", "arrival")
+        if item.get(leg, {}).get("icao")
+    ]
+    airlines = [item.get("airline") for item in items if _looks_like_airline_icao(item.get("airline"))]
+    airport_names, airline_names = await resolve_icao_codes(airports, airlines)
+
+    for item in items:
+        for leg in ("departure", "arrival"):
+            data = item.get(leg) or {}
+            code = str(data.get("icao") or "").upper()
+            if code in airport_names:
+                data["city"], data["name"] = airport_names[code]
+        code = str(item.get("airline") or "").strip().upper()
+        name, country = airline_names.get(code, ("", ""))
+        if name or country:
+            item["airline_info"] = {"name": name, "country": country}
+
+
+def _build_history(flight_number: str, summary: Any) -> Optional[List[Dict[str, Any]]]:
+    try:
+        data = _response_data(summary)
+
+        if not isinstance(data, list) or not data:
+            return []
+
+        history: List[Dict[str, Any]] = []
+        for item in data:
+            dep_code = _safe_get(item, "orig_icao", "")
+            arr_code = _safe_get(item, "dest_icao_actual", "") or _safe_get(item, "dest_icao", "")
+
+            scheduled_dep = _to_str(_safe_get(item, "first_seen", None))
+            actual_dep = _to_str(_safe_get(item, "datetime_takeoff", None))
+            scheduled_arr = _to_str(_safe_get(item, "last_seen", None))
+            actual_arr = _to_str(_safe_get(item, "datetime_landed", None))
+
+            airline_name = _safe_get(item, "operating_as", "") or _safe_get(item, "painted_as", "")
+            number_field = _safe_get(item, "flight", "") or _safe_get(item, "callsign", "")
+            number_final = number_field or flight_number
+
+            aircraft_model = _safe_get(item, "aircraft", "") or _safe_get(item, "model", "")
+            aircraft_icao = _safe_get(item, "aircraft_icao", "")
+            registration = _safe_get(item, "registration", "") or _safe_get(item, "reg", "")
+            distance_val = _safe_get(item, "distance", None)
+            try:
+                distance_km = None
+                if distance_val is not None and str(distance_val).strip() != "":
+                    # Пытаемся привести к километрам
+                    d = float(distance_val)
+                    distance_km = int(round(d))
+            except Exception:
+                distance_km = None
+
+            dt_sched_dep = _parse_iso(scheduled_dep)
+            dt_act_dep = _parse_iso(actual_dep)
+            dt_sched_arr = _parse_iso(scheduled_arr)
+            dt_act_arr = _parse_iso(actual_arr)
+
+            duration_min = None
+            if dt_act_dep and dt_act_arr:
                 try:
-                    if obj is None:
-                        return default
-                    if isinstance(obj, dict):
-                        return obj.get(key, default)
-                    return getattr(obj, key, default)
+                    duration_min = int((dt_act_arr - dt_act_dep).total_seconds() // 60)
                 except Exception:
-                    return default
-
-            def to_str(dt: Any) -> str:
-                try:
-                    if dt is None:
-                        return ""
-                    if isinstance(dt, datetime):
-                        return dt.isoformat()
-                    return str(dt)
-                except Exception:
-                    return ""
+                    duration_min = None
 
-            def parse_iso(value: Any) -> Optional[datetime]:
+            delay_dep_min = None
+            if dt_sched_dep and dt_act_dep:
                 try:
-                    s = to_str(value)
-                    if not s:
-                        return None
-                    if s.endswith("Z"):
-                        s = s[:-1] + "+00:00"
-                    return datetime.fromisoformat(s)
+                    delay_dep_min = int((dt_act_dep - dt_sched_dep).total_seconds() // 60)
                 except Exception:
-                    return None
+                    delay_dep_min = None
 
-            with Client(api_token=os.getenv("FR24_API_KEY")) as client:
+            delay_arr_min = None
+            if dt_sched_arr and dt_act_arr:
                 try:
-                    summary = client.flight_summary.get_light(
-                        flights=[flight_number],
-                        flight_datetime_from=date_from_str,
-                        flight_datetime_to=date_to_str,
-                    )
+                    delay_arr_min = int((dt_act_arr - dt_sched_arr).total_seconds() // 60)
                 except Exception:
-                    summary = None
-
-                data = getattr(summary, "data", None)
-                if data is None and isinstance(summary, dict):
-                    data = summary.get("data")
-
-                if not isinstance(data, list) or not data:
-                    return []
-
-                history: List[Dict[str, Any]] = []
-                for item in data:
-                    dep_code = safe_get(item, "orig_icao", "")
-                    arr_code = safe_get(item, "dest_icao_actual", "") or safe_get(item, "dest_icao", "")
-
-                    scheduled_dep = to_str(safe_get(item, "first_seen", None))
-                    actual_dep = to_str(safe_get(item, "datetime_takeoff", None))
-                    scheduled_arr = to_str(safe_get(item, "last_seen", None))
-                    actual_arr = to_str(safe_get(item, "datetime_landed", None))
-
-                    airline_name = safe_get(item, "operating_as", "") or safe_get(item, "painted_as", "")
-                    number_field = safe_get(item, "flight", "") or safe_get(item, "callsign", "")
-                    number_final = number_field or flight_number
-
-                    aircraft_model = safe_get(item, "aircraft", "") or safe_get(item, "model", "")
-                    aircraft_icao = safe_get(item, "aircraft_icao", "")
-                    registration = safe_get(item, "registration", "") or safe_get(item, "reg", "")
-                    distance_val = safe_get(item, "distance", None)
-                    try:
-                        distance_km = None
-                        if distance_val is not None and str(distance_val).strip() != "":
-                            # Пытаемся привести к километрам
-                            d = float(distance_val)
-                            distance_km = int(round(d))
-                    except Exception:
-                        distance_km = None
-
-                    dt_sched_dep = parse_iso(scheduled_dep)
-                    dt_act_dep = parse_iso(actual_dep)
-                    dt_sched_arr = parse_iso(scheduled_arr)
-                    dt_act_arr = parse_iso(actual_arr)
-
-                    duration_min = None
-                    if dt_act_dep and dt_act_arr:
-                        try:
-                            duration_min = int((dt_act_arr - dt_act_dep).total_seconds() // 60)
-                        except Exception:
-                            duration_min = None
-
-                    delay_dep_min = None
-                    if dt_sched_dep and dt_act_dep:
-                        try:
-                            delay_dep_min = int((dt_act_dep - dt_sched_dep).total_seconds() // 60)
-                        except Exception:
-                            delay_dep_min = None
-
                     delay_arr_min = None
-                    if dt_sched_arr and dt_act_arr:
-                        try:
-                            delay_arr_min = int((dt_act_arr - dt_sched_arr).total_seconds() // 60)
-                        except Exception:
-                            delay_arr_min = None
-
-                    dep_city, dep_name = get_airport_city_name_by_icao(dep_code)
-                    arr_city, arr_name = get_airport_city_name_by_icao(arr_code)
-
-                    history.append({
-                        "flight_number": number_final,
-                        "airline": airline_name,
-                        "departure": {
-                            "icao": dep_code,
-                            "city": dep_city,
-                            "name": dep_name,
-                            "scheduled": scheduled_dep,
-                            "actual": actual_dep,
-                        },
-                        "arrival": {
-                            "icao": arr_code,
-                            "city": arr_city,
-                            "name": arr_name,
-                            "scheduled": scheduled_arr,
-                            "actual": actual_arr,
-                        },
-                        "aircraft": {
-                            "model": aircraft_model,
-                            "icao": aircraft_icao,
-                            "registration": registration,
-                        },
-                        "duration_min": duration_min,
-                        "distance_km": distance_km,
-                        "delay": {
-                            "departure_min": delay_dep_min,
-                            "arrival_min": delay_arr_min,
-                        }
-                    })
-
-                return history
-        except Exception:
-            return None
 
-    return await loop.run_in_executor(None, _call_sdk_hist)
+            history.append({
+                "flight_number": number_final,
+                "airline": airline_name,
+                "departure": {
+                    "icao": dep_code,
+                    "city": "",
+                    "name": "",
+                    "scheduled": scheduled_dep,
+                    "actual": actual_dep,
+                },
+                "arrival": {
+                    "icao": arr_code,
+                    "city": "",
+                    "name": "",
+                    "scheduled": scheduled_arr,
+                    "actual": actual_arr,
+                },
+                "aircraft": {
+                    "model": aircraft_model,
+                    "icao": aircraft_icao,
+                    "registration": registration,
+                },
+                "duration_min": duration_min,
+                "distance_km": distance_km,
+                "delay": {
+                    "departure_min": delay_dep_min,
+                    "arrival_min": delay_arr_min,
+                }
+            })
+
+        return history
+    except Exception:
+        return None
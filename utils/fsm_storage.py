@@ -0,0 +1,36 @@
+import json
+import os
+from functools import partial
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+# redis — состояние диалогов в Redis (общее для всех реплик), memory — в памяти процесса
+FSM_STORAGE = os.getenv("FSM_STORAGE", "redis").lower()
+# Брошенный диалог (например, выбор города без ответа) удаляется через столько секунд
+FSM_TTL = int(os.getenv("FSM_TTL", "21600"))
+
+# Компактный JSON: без пробелов и \u-экранирования кириллицы в названиях аэропортов
+_dumps = partial(json.dumps, ensure_ascii=False, separators=(",", ":"))
+
+
+async def create_fsm_storage() -> BaseStorage:
+    """RedisStorage на общем клиенте redis.asyncio; при недоступном Redis — MemoryStorage."""
+    if FSM_STORAGE != "redis" or not os.getenv("REDIS_URL"):
+        return MemoryStorage()
+    try:
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+        from utils.redis_client import get_async_redis
+
+        redis = get_async_redis()
+        await redis.ping()
+        return RedisStorage(
+            redis,
+            key_builder=DefaultKeyBuilder(prefix="fsm"),
+            state_ttl=FSM_TTL,
+            data_ttl=FSM_TTL,
+            json_dumps=_dumps,
+        )
+    except Exception as e:
+        print(f"FSM: Redis недоступен ({e}), состояние диалогов хранится в памяти процесса")
+        return MemoryStorage()
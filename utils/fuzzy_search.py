@@ -0,0 +1,190 @@
+import heapq
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils.city_index import normalize_text, transliterate, CITY_ALIASES, has_cyrillic
+
+# Сколько лучших по числу общих триграмм ключей проверять расстоянием редактирования
+FUZZY_MAX_CANDIDATES = int(os.getenv("FUZZY_MAX_CANDIDATES", "64"))
+
+# Служебные слова в названиях аэропортов — они есть почти везде и только мешают поиску
+_STOPWORDS = {
+    "airport", "international", "regional", "municipal", "airfield", "aerodrome",
+    "аэропорт", "международный",
+}
+
+
+def _trigrams(value: str) -> List[str]:
+    padded = f"  {value} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _name_key(value: str) -> str:
+    return " ".join(w for w in normalize_text(value).split() if w not in _STOPWORDS)
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна (с перестановкой соседних символов) или limit + 1, если оно больше limit.
+
+    Считается только полоса |i - j| <= limit, поэтому стоимость O(len(a) * limit).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    over = limit + 1
+    n = len(b)
+    prev2: Optional[List[int]] = None
+    prev = [j if j <= limit else over for j in range(n + 1)]
+    for i in range(1, len(a) + 1):
+        lo = max(1, i - limit)
+        hi = min(n, i + limit)
+        cur = [over] * (n + 1)
+        if i <= limit:
+            cur[0] = i
+        ca = a[i - 1]
+        row_min = cur[0] if lo == 1 else over
+        for j in range(lo, hi + 1):
+            cb = b[j - 1]
+            value = prev[j - 1] + (ca != cb)
+            if prev[j] + 1 < value:
+                value = prev[j] + 1
+            if cur[j - 1] + 1 < value:
+                value = cur[j - 1] + 1
+            if prev2 is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb and prev2[j - 2] + 1 < value:
+                value = prev2[j - 2] + 1
+            cur[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        prev2, prev = prev, cur
+    return prev[n] if prev[n] <= limit else over
+
+
+class FuzzySearchEngine:
+    """Нечёткий поиск по названиям городов и аэропортов с ранжированием.
+
+    Индекс строится один раз: уникальные нормализованные ключи (полные названия
+    и отдельные слова) и триграммы, разложенные по длине ключа. Кандидаты
+    проверяются ограниченным расстоянием редактирования в порядке убывания числа
+    общих триграмм; по лемме о q-граммах перебор останавливается, как только
+    оставшиеся кандидаты заведомо хуже уже найденных. Результаты упорядочены
+    по расстоянию, затем по важности аэропорта.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, Sequence[str], str, float]]):
+        """`entries` — (code, names, label, importance); names — город, название аэропорта и т.п."""
+        self._entries: List[Tuple[str, str, float]] = []
+        self._keys: List[str] = []
+        self._key_entries: List[List[int]] = []
+        key_ids: Dict[str, int] = {}
+        # триграмма -> длина ключа -> номера ключей
+        self._postings: Dict[str, Dict[int, List[int]]] = {}
+        for code, names, label, importance in entries:
+            idx = len(self._entries)
+            self._entries.append((code, label, importance))
+            keys = set()
+            for name in names:
+                key = _name_key(name or "")
+                if not key:
+                    continue
+                keys.add(key)
+                # Отдельные слова, чтобы "Frankfurt" находил "Frankfurt am Main"
+                keys.update(w for w in key.split() if len(w) >= 4)
+            for key in keys:
+                key_id = key_ids.get(key)
+                if key_id is None:
+                    key_id = key_ids[key] = len(self._keys)
+                    self._keys.append(key)
+                    self._key_entries.append([])
+                    for gram in set(_trigrams(key)):
+                        self._postings.setdefault(gram, {}).setdefault(len(key), []).append(key_id)
+                self._key_entries[key_id].append(idx)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def search(self, query: str, limit: int = 5, max_distance: Optional[int] = None) -> List[Tuple[str, str]]:
+        """[(code, label)] по запросу с опечатками; лучшие совпадения первыми."""
+        q = _name_key(query)
+        if not q:
+            return []
+        variants = {q}
+        if has_cyrillic(q):
+            variants.add(transliterate(q))
+        best: Dict[int, Tuple[int, float, str]] = {}
+        for variant in variants:
+            k = max_distance if max_distance is not None else self._default_distance(variant)
+            for key_id, distance in self._matches(variant, k, limit):
+                for idx in self._key_entries[key_id]:
+                    code, label, importance = self._entries[idx]
+                    rank = (distance, -importance, label)
+                    if idx not in best or rank < best[idx]:
+                        best[idx] = rank
+        ranked = heapq.nsmallest(limit, best.items(), key=lambda item: item[1])
+        return [(self._entries[idx][0], self._entries[idx][1]) for idx, _ in ranked]
+
+    @staticmethod
+    def _default_distance(query: str) -> int:
+        if len(query) <= 4:
+            return 1
+        if len(query) <= 8:
+            return 2
+        return 3
+
+    def _matches(self, query: str, k: int, limit: int) -> List[Tuple[int, int]]:
+        grams = set(_trigrams(query))
+        lengths = range(max(1, len(query) - k), len(query) + k + 1)
+        counts: Dict[int, int] = {}
+        for gram in grams:
+            buckets = self._postings.get(gram)
+            if not buckets:
+                continue
+            for length in lengths:
+                for key_id in buckets.get(length, ()):
+                    counts[key_id] = counts.get(key_id, 0) + 1
+
+        # Одна правка портит не больше трёх триграмм: distance >= (len(grams) - общие) / 3
+        total = len(grams)
+        found: List[Tuple[int, int]] = []
+        worst = k
+        candidates = heapq.nlargest(FUZZY_MAX_CANDIDATES, counts.items(), key=lambda item: item[1])
+        for key_id, count in candidates:
+            lower_bound = -(-(total - count) // 3)
+            if lower_bound > worst:
+                break
+            distance = bounded_levenshtein(query, self._keys[key_id], worst)
+            if distance > worst:
+                continue
+            found.append((key_id, distance))
+            if len(found) >= limit:
+                # Дальше интересны только кандидаты не хуже худшего из найденных
+                worst = min(worst, max(d for _, d in found))
+        return found
+
+
+_iata_engine = None  # type: Optional[FuzzySearchEngine]
+
+
+def get_iata_search_engine() -> FuzzySearchEngine:
+    """Поиск по аэропортам, доступным для отслеживания цен (IATA из airport_codes).
+
+    Важность — позиция в airport_names: словарь начинается с крупных хабов, поэтому
+    при равном расстоянии "Масква" даёт SVO, DME, VKO, а не порядок по алфавиту.
+    """
+    global _iata_engine
+    if _iata_engine is None:
+        from utils.airport_codes import airport_names
+
+        def _entries():
+            total = len(airport_names)
+            for position, (code, label) in enumerate(airport_names.items()):
+                city, _, rest = label.partition(" (")
+                airport = rest.rstrip(")").split(" — ")[0]
+                city_norm = normalize_text(city)
+                names = [city, airport, transliterate(city_norm)] + CITY_ALIASES.get(city_norm, [])
+                yield code, names, label, float(total - position)
+
+        _iata_engine = FuzzySearchEngine(_entries())
+    return _iata_engine
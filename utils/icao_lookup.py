@@ -0,0 +1,73 @@
+import os
+from typing import Dict, Iterable, List, Tuple
+
+# Справочник почти не меняется, поэтому найденные значения держим в памяти процесса
+ICAO_CACHE_MAX_ENTRIES = int(os.getenv("ICAO_CACHE_MAX_ENTRIES", "30000"))
+
+_airport_cache: Dict[str, Tuple[str, str]] = {}
+_airline_cache: Dict[str, Tuple[str, str]] = {}
+
+
+async def resolve_icao_codes(airports: Iterable[str] = (),
+                             airlines: Iterable[str] = ()) -> Tuple[Dict[str, Tuple[str, str]],
+                                                                    Dict[str, Tuple[str, str]]]:
+    """Разрешает ICAO-коды аэропортов и авиакомпаний одним pipeline-запросом к Redis.
+
+    Возвращает ({code: (city, name)}, {code: (name, country)}). Сначала смотрит
+    в кэш процесса, затем в Redis (redis.asyncio), для отсутствующих — локальный справочник (utils/reference_store).
+    """
+    airport_codes = {str(c).upper() for c in airports if c}
+    airline_codes = {str(c).upper() for c in airlines if c}
+
+    missing_airports = [c for c in airport_codes if c not in _airport_cache]
+    missing_airlines = [c for c in airline_codes if c not in _airline_cache]
+    if missing_airports or missing_airlines:
+        fetched_airports, fetched_airlines = await _fetch_from_redis(missing_airports, missing_airlines)
+        # Чего нет в Redis — одним запросом к локальному справочнику
+        from utils.reference_store import get_airports, get_airlines
+        local_airports = get_airports(c for c in missing_airports if not fetched_airports.get(c))
+        local_airlines = get_airlines(c for c in missing_airlines if not fetched_airlines.get(c))
+        for code in missing_airports:
+            data = fetched_airports.get(code)
+            if data:
+                value = (data.get("city", "") or "", data.get("name", "") or "")
+            else:
+                value = local_airports.get(code) or ("", "")
+            _remember(_airport_cache, code, value)
+        for code in missing_airlines:
+            data = fetched_airlines.get(code)
+            if data:
+                value = (data.get("name", "") or "", data.get("country", "") or "")
+            else:
+                value = local_airlines.get(code) or ("", "")
+            _remember(_airline_cache, code, value)
+
+    return (
+        {c: _airport_cache.get(c, ("", "")) for c in airport_codes},
+        {c: _airline_cache.get(c, ("", "")) for c in airline_codes},
+    )
+
+
+async def _fetch_from_redis(airports: List[str], airlines: List[str]) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    try:
+        from utils.redis_client import get_async_redis
+        r = get_async_redis()
+        async with r.pipeline(transaction=False) as pipe:
+            for code in airports:
+                pipe.hgetall(f"icao:airport:{code}")
+            for code in airlines:
+                pipe.hgetall(f"icao:airline:{code}")
+            results = await pipe.execute()
+    except Exception:
+        # Redis недоступен — ниже сработает фолбэк к локальным словарям
+        return {}, {}
+
+    fetched_airports = dict(zip(airports, results[:len(airports)]))
+    fetched_airlines = dict(zip(airlines, results[len(airports):]))
+    return fetched_airports, fetched_airlines
+
+
+def _remember(cache: Dict[str, Tuple[str, str]], code: str, value: Tuple[str, str]):
+    if len(cache) >= ICAO_CACHE_MAX_ENTRIES:
+        cache.pop(next(iter(cache)))
+    cache[code] = value
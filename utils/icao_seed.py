@@ -1,56 +1,113 @@
-from typing import Dict, Tuple
+import asyncio
+import hashlib
+import os
+from typing import Dict, Iterator, List, Tuple
 
+# Сколько ключей отправлять в Redis одним pipeline
+ICAO_SEED_BATCH = int(os.getenv("ICAO_SEED_BATCH", "500"))
 
-def seed_icao_if_needed(force: bool = False) -> None:
-    """Заполняет Redis ICAO-данными из локальных словарей, если ещё не заполнено.
+VERSION_KEY = "icao:version"
+# Хэши записей прежней схемы: сверка теперь идёт по самим ключам, хэш удаляется при синхронизации
+LEGACY_DIGESTS_KEY = "icao:digests"
+KEY_PATTERNS = ("icao:airport:*", "icao:airline:*")
+
+
+def _digest(values: Tuple[str, str]) -> str:
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()[:16]
+
+
+def _dataset() -> Iterator[Tuple[str, Dict[str, str]]]:
+    from utils.reference_store import iter_airports, iter_airlines
+    for code, value in iter_airports():
+        city, name = (value or ("", ""))
+        yield f"icao:airport:{str(code).upper()}", {"city": city or "", "name": name or ""}
+    for code, value in iter_airlines():
+        name, country = (value or ("", ""))
+        yield f"icao:airline:{str(code).upper()}", {"name": name or "", "country": country or ""}
+
+
+def _collect() -> Tuple[Dict[str, Dict[str, str]], str]:
+    records: Dict[str, Dict[str, str]] = dict(_dataset())
+    version = hashlib.sha1(
+        "\n".join(f"{key}={_digest(tuple(records[key].values()))}" for key in sorted(records)).encode("utf-8")
+    ).hexdigest()
+    return records, version
+
+
+async def seed_icao_if_needed(force: bool = False) -> None:
+    """Синхронизирует ICAO-данные в Redis с локальным справочником.
 
     - Аэропорты: ключ `icao:airport:<CODE>` (HASH) с полями city, name
     - Авиакомпании: ключ `icao:airline:<CODE>` (HASH) с полями name, country
-    - Маркер инициализации: `icao:seeded` = "1"
+    - Версия набора: `icao:version` — хэш содержимого; совпала и все ключи на месте — ничего не делаем
+    - Иначе каждая запись сверяется с тем, что реально лежит в Redis (ручные правки,
+      eviction, частичный FLUSH), и переписываются только расходящиеся; лишние ключи удаляются
+
+    Чтение и запись идут пачками по ICAO_SEED_BATCH ключей, так что Redis не получает
+    многомегабайтный буфер одной командой. `force` переписывает все ключи.
+    Рассчитана на запуск фоновой задачей: ошибки только печатаются.
     """
     try:
-        from utils.redis_client import get_redis
-        from utils.airport_icao import airport_icao  # dict[str, tuple[str, str]]
-        from utils.airlines_icao import airlines_icao  # dict[str, tuple[str, str]]
-    except Exception:
-        # Если что-то пошло не так с импортами — ничего не делаем
-        return
-
-    r = None
-    try:
-        r = get_redis()
-        if not force:
-            try:
-                if r.get("icao:seeded") == "1":
-                    return
-            except Exception:
-                # Продолжаем, попробуем сделать вставку всё равно
-                pass
-
-        pipe = r.pipeline(transaction=False)
-
-        # Аэропорты
-        try:
-            for code, value in airport_icao.items():
-                city, name = (value or ("", ""))
-                key = f"icao:airport:{str(code).upper()}"
-                pipe.hset(key, mapping={"city": city or "", "name": name or ""})
-        except Exception:
-            # Не прерываем — попробуем авиакомпании и маркер
-            pass
-
-        # Авиакомпании
-        try:
-            for code, value in airlines_icao.items():
-                name, country = (value or ("", ""))
-                key = f"icao:airline:{str(code).upper()}"
-                pipe.hset(key, mapping={"name": name or "", "country": country or ""})
-        except Exception:
-            pass
-
-        pipe.set("icao:seeded", "1")
-        pipe.execute()
-    except Exception:
-        # Тихий фолбэк: если Redis недоступен — просто пропустим
-        return
+        from utils.redis_client import get_async_redis
+
+        # Чтение справочника и хэш версии (~15 тыс. записей) — в потоке, чтобы не держать event loop
+        records, version = await asyncio.to_thread(_collect)
+        keys = sorted(records)
+
+        r = get_async_redis()
+        if not force and await r.get(VERSION_KEY) == version and await _count_existing(r, keys) == len(keys):
+            return
+
+        changed = keys if force else await _stale_keys(r, keys, records)
+        removed = []
+        for pattern in KEY_PATTERNS:
+            async for key in r.scan_iter(match=pattern, count=ICAO_SEED_BATCH):
+                if key not in records:
+                    removed.append(key)
+
+        for chunk in _chunks(changed, ICAO_SEED_BATCH):
+            # MULTI: читатель не увидит ключ удалённым между DEL и HSET
+            async with r.pipeline(transaction=True) as pipe:
+                for key in chunk:
+                    # DEL убирает поля, добавленные вручную, которых нет в справочнике
+                    pipe.delete(key)
+                    pipe.hset(key, mapping=records[key])
+                await pipe.execute()
+
+        for chunk in _chunks(removed, ICAO_SEED_BATCH):
+            await r.delete(*chunk)
+
+        # Версия пишется последней: прерванная синхронизация повторится при следующем запуске
+        await r.delete(LEGACY_DIGESTS_KEY)
+        await r.set(VERSION_KEY, version)
+        await r.set("icao:seeded", "1")
+        print(f"ICAO в Redis: обновлено {len(changed)}, удалено {len(removed)} (версия {version[:12]})")
+    except Exception as e:
+        # Redis недоступен — поиск по ICAO работает через локальный справочник
+        print(f"Не удалось синхронизировать ICAO в Redis: {e}")
+
+
+async def _count_existing(r, keys: List[str]) -> int:
+    """Сколько ключей из `keys` есть в Redis (EXISTS по пачкам в одном pipeline)."""
+    async with r.pipeline(transaction=False) as pipe:
+        for chunk in _chunks(keys, ICAO_SEED_BATCH):
+            pipe.exists(*chunk)
+        return sum(await pipe.execute())
+
+
+async def _stale_keys(r, keys: List[str], records: Dict[str, Dict[str, str]]) -> List[str]:
+    """Ключи, которых нет в Redis или чьё содержимое отличается от справочника."""
+    stale = []
+    for chunk in _chunks(keys, ICAO_SEED_BATCH):
+        async with r.pipeline(transaction=False) as pipe:
+            for key in chunk:
+                pipe.hgetall(key)
+            stored = await pipe.execute()
+        stale.extend(key for key, value in zip(chunk, stored) if value != records[key])
+    return stale
+
 
+def _chunks(items: List[str], size: int) -> Iterator[List[str]]:
+    size = max(1, size)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional, Set
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+)
+
+from create_bot import bot
+from db_handlers.db_class import db
+from utils.rate_limiter import SharedTokenBucket
+
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_GLOBAL_BURST = int(os.getenv("TELEGRAM_GLOBAL_BURST", "30"))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1.0"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+# Потолок паузы между повторами при сетевых ошибках и 5xx
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+# Через сколько секунд без heartbeat сообщения процесса считаются брошенными и их забирает другой
+OUTBOX_CLAIM_TTL = float(os.getenv("OUTBOX_CLAIM_TTL", "600"))
+# Как часто продлевать захват своих сообщений и искать брошенные
+OUTBOX_HEARTBEAT = min(float(os.getenv("OUTBOX_HEARTBEAT", "60")), OUTBOX_CLAIM_TTL / 3)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ALERT = 1
+
+# Вызов Bot API из воркера очереди: он уже прошёл лимиты, middleware его пропускает
+_outbox_call = contextvars.ContextVar("outbox_call", default=False)
+
+
+class _Message:
+    __slots__ = ("chat_id", "text", "options", "priority", "spool_id", "attempts")
+
+    def __init__(self, chat_id: int, text: str, options: dict, priority: int, spool_id: Optional[int] = None):
+        self.chat_id = chat_id
+        self.text = text
+        self.options = options
+        self.priority = priority
+        self.spool_id = spool_id
+        self.attempts = 0
+
+
+class TelegramRateMiddleware(BaseRequestMiddleware):
+    """Ставит прямые вызовы Bot API (ответы в хендлерах) под общий лимит очереди.
+
+    Ответы пользователю идут с приоритетом PRIORITY_INTERACTIVE — раньше ожидающих уведомлений.
+    """
+
+    def __init__(self, outbox: "Outbox"):
+        self.outbox = outbox
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or _outbox_call.get():
+            return await make_request(bot, method)
+        await self.outbox.limiter.acquire(priority=PRIORITY_INTERACTIVE)
+        self.outbox.note_chat_send(chat_id)
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.outbox.on_retry_after(chat_id, e.retry_after)
+            raise
+
+
+class Outbox:
+    """Единая очередь исходящих уведомлений.
+
+    - Общий token bucket (TELEGRAM_GLOBAL_RATE) и пауза TELEGRAM_CHAT_INTERVAL между
+      сообщениями в один чат; сообщение, чей чат ещё «остывает», не задерживает другие.
+    - Приоритеты: меньшее значение уходит раньше; ответы в хендлерах проходят
+      тот же лимит через TelegramRateMiddleware с наивысшим приоритетом.
+    - Общий bucket разделяют все процессы бота (SharedTokenBucket в Redis).
+    - RetryAfter от Telegram: на паузу ставится только этот чат, сообщение повторяется
+      без счёта попыток; сетевые ошибки и 5xx — повтор с экспоненциальной паузой.
+    - persist=True: сообщение сначала пишется в спул SQLite (таблица outbox) и удаляется
+      оттуда только после доставки или окончательного отказа (бот заблокирован и т.п.).
+      Процесс раз в OUTBOX_HEARTBEAT продлевает захват своих сообщений и забирает
+      брошенные (захват старше OUTBOX_CLAIM_TTL) — после падения воркера их дошлёт другой.
+    """
+
+    def __init__(self, rate: float = TELEGRAM_GLOBAL_RATE, burst: int = TELEGRAM_GLOBAL_BURST,
+                 chat_interval: float = TELEGRAM_CHAT_INTERVAL, workers: int = OUTBOX_WORKERS):
+        # Лимит Telegram — на бота целиком, поэтому bucket общий для процессов bot и worker
+        self.limiter = SharedTokenBucket(rate, burst, name="telegram")
+        self.chat_interval = chat_interval
+        self.workers = max(1, workers)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._ready: List[tuple] = []    # (priority, seq, message)
+        self._delayed: List[tuple] = []  # (due, seq, message)
+        self._chat_next: Dict[int, float] = {}
+        self._in_flight: Set[int] = set()
+        self._seq = itertools.count()
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._middleware_installed = False
+
+    def __len__(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    async def start(self, claim_all: bool = False):
+        """Запускает отправку и подхватывает спул.
+
+        `claim_all` — забрать все недоставленные сообщения (единственный процесс, RUN_MODE=all);
+        иначе только ничьи и брошенные дольше OUTBOX_CLAIM_TTL.
+        """
+        if self._tasks:
+            return
+        if not self._middleware_installed:
+            bot.session.middleware(TelegramRateMiddleware(self))
+            self._middleware_installed = True
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks.append(asyncio.create_task(self._dispatch()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._work()))
+        try:
+            await self._claim(None if claim_all else time.time() - OUTBOX_CLAIM_TTL)
+        except Exception as e:
+            print(f"Не удалось прочитать спул сообщений: {e}")
+        self._tasks.append(asyncio.create_task(self._claims_loop()))
+
+    async def _claim(self, stale_before: Optional[float], batch: int = 500):
+        claimed = 0
+        while True:
+            rows = await db.claim_outbox_messages(self.owner, stale_before, limit=batch)
+            for row in rows:
+                options = json.loads(row["options"]) if row["options"] else {}
+                self._push(_Message(row["chat_id"], row["text"], options, row["priority"], row["id"]))
+            claimed += len(rows)
+            if len(rows) < batch:
+                break
+        if claimed:
+            print(f"Очередь сообщений: забрано {claimed} недоставленных из спула")
+
+    async def _claims_loop(self):
+        while True:
+            await asyncio.sleep(OUTBOX_HEARTBEAT)
+            try:
+                await db.refresh_outbox_claims(self.owner)
+                await self._claim(time.time() - OUTBOX_CLAIM_TTL)
+            except Exception as e:
+                print(f"Ошибка обслуживания спула сообщений: {e}")
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Недоставленное остаётся в спуле; отпускаем его для следующего запуска
+        try:
+            await db.release_outbox_messages(self.owner)
+        except Exception:
+            pass
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_ALERT,
+                   persist: bool = True, **options):
+        """Ставит сообщение в очередь. `options` — аргументы send_message (должны сериализоваться в JSON)."""
+        message = _Message(chat_id, text, options, priority)
+        if persist:
+            message.spool_id = await db.add_outbox_message(
+                chat_id, text, json.dumps(options, ensure_ascii=False) if options else None, priority, self.owner
+            )
+        self._push(message)
+
+    def note_chat_send(self, chat_id: int):
+        """Учитывает отправку в чат мимо очереди, чтобы следующее уведомление выдержало паузу."""
+        self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), time.monotonic() + self.chat_interval)
+
+    def on_retry_after(self, chat_id: int, retry_after: float):
+        # Flood-limit одного чата не должен тормозить ответы остальным: пауза только для чата
+        self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), time.monotonic() + retry_after)
+
+    def _push(self, message: _Message, delay: float = 0.0):
+        if delay > 0:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), message))
+        else:
+            heapq.heappush(self._ready, (message.priority, next(self._seq), message))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, message = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (message.priority, next(self._seq), message))
+
+            if self._ready:
+                _, _, message = heapq.heappop(self._ready)
+                chat_ready_at = self._chat_next.get(message.chat_id, 0.0)
+                if message.chat_id in self._in_flight:
+                    # Предыдущее сообщение в этот чат ещё ждёт общего лимита
+                    chat_ready_at = max(chat_ready_at, now + self.chat_interval)
+                if chat_ready_at > now:
+                    # Чат ещё на паузе — откладываем только это сообщение
+                    heapq.heappush(self._delayed, (chat_ready_at, next(self._seq), message))
+                    continue
+                self._chat_next[message.chat_id] = now + self.chat_interval
+                self._in_flight.add(message.chat_id)
+                # Очередь ограничена числом воркеров: дальше ждём свободного отправителя
+                await self._queue.put(message)
+                continue
+
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._prune_chats(now)
+
+    def _prune_chats(self, now: float):
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: due for chat, due in self._chat_next.items() if due > now}
+
+    async def _work(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                print(f"Ошибка очереди сообщений: {e}")
+            finally:
+                self._in_flight.discard(message.chat_id)
+                self._queue.task_done()
+
+    async def _deliver(self, message: _Message):
+        await self.limiter.acquire(priority=message.priority)
+        # Пауза чата отсчитывается от фактической отправки, а не от выдачи воркеру
+        self.note_chat_send(message.chat_id)
+        token = _outbox_call.set(True)
+        try:
+            await bot.send_message(message.chat_id, message.text, **message.options)
+        except TelegramRetryAfter as e:
+            self.on_retry_after(message.chat_id, e.retry_after)
+            self._push(message, e.retry_after)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound) as e:
+            # Повтор не поможет: бот заблокирован, чат удалён, некорректный текст
+            print(f"Сообщение в чат {message.chat_id} не доставлено: {e}")
+            self._done(message)
+            return
+        except Exception as e:
+            message.attempts += 1
+            delay = min(OUTBOX_MAX_BACKOFF, 2 ** message.attempts) * random.uniform(0.5, 1.0)
+            print(f"Ошибка Telegram (чат {message.chat_id}, попытка {message.attempts}): {e}")
+            self._push(message, delay)
+            return
+        finally:
+            _outbox_call.reset(token)
+        self._done(message)
+
+    def _done(self, message: _Message):
+        if message.spool_id is not None:
+            db.delete_outbox_message(message.spool_id)
+
+
+outbox = Outbox()
@@ -0,0 +1,100 @@
+import datetime
+import os
+from typing import Dict, Iterable, Optional
+
+# adaptive — интервал зависит от близости вылета и движения цены, fixed — всегда POLL_INTERVAL
+POLL_POLICY = os.getenv("POLL_POLICY", "adaptive").lower()
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "100"))
+# Ближе стольких дней до вылета цена опрашивается раз в POLL_NEAR_INTERVAL, без отступа
+POLL_NEAR_DAYS = int(os.getenv("POLL_NEAR_DAYS", "7"))
+POLL_NEAR_INTERVAL = float(os.getenv("POLL_NEAR_INTERVAL", "60"))
+# Дальше стольких дней базовый интервал растёт пропорционально сроку до вылета
+POLL_FAR_DAYS = int(os.getenv("POLL_FAR_DAYS", "30"))
+# Потолок интервала для дат, цена на которые долго не меняется
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "3600"))
+# Во сколько раз растёт интервал после каждой проверки без изменения цены
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "2"))
+# Относительное изменение цены, которое считается движением (0.01 — 1%)
+POLL_PRICE_CHANGE = float(os.getenv("POLL_PRICE_CHANGE", "0.01"))
+
+
+def days_until(date: str, today: Optional[datetime.date] = None) -> Optional[int]:
+    """Дней до даты вылета (YYYY-MM-DD или YYYY-MM для пакетного режима)."""
+    today = today or datetime.date.today()
+    try:
+        if len(date) == 7:
+            date += "-01"
+        return (datetime.date.fromisoformat(date[:10]) - today).days
+    except Exception:
+        return None
+
+
+class PollPolicy:
+    """Интервал опроса ключа (маршрут + дата/месяц) по результатам последней проверки.
+
+    - Базовый интервал: POLL_NEAR_INTERVAL за POLL_NEAR_DAYS до вылета, POLL_INTERVAL до
+      POLL_FAR_DAYS, дальше растёт линейно со сроком (дата через 240 дней при настройках
+      по умолчанию — 8 × POLL_INTERVAL), но не выше POLL_MAX_INTERVAL.
+    - Каждая проверка без движения цены умножает интервал на POLL_BACKOFF; движение цены
+      возвращает его к базовому. Близкие даты (POLL_NEAR_DAYS) всегда опрашиваются раз
+      в POLL_NEAR_INTERVAL.
+
+    Состояние ключа — словарь `cadence` (interval, stable_checks, prices), его хранит планировщик.
+    """
+
+    def __init__(self, adaptive: bool = POLL_POLICY == "adaptive"):
+        self.adaptive = adaptive
+
+    @staticmethod
+    def new_cadence() -> dict:
+        return {"interval": POLL_INTERVAL, "stable_checks": 0, "prices": {}}
+
+    def base_interval(self, days: Optional[int]) -> float:
+        if days is None:
+            return POLL_INTERVAL
+        if days <= POLL_NEAR_DAYS:
+            return POLL_NEAR_INTERVAL
+        if days <= POLL_FAR_DAYS:
+            return POLL_INTERVAL
+        return min(POLL_MAX_INTERVAL, POLL_INTERVAL * days / POLL_FAR_DAYS)
+
+    def update(self, cadence: dict, dates: Iterable[str], prices: Dict[str, Optional[int]],
+               from_cache: bool = False) -> float:
+        """Учитывает результат проверки и возвращает интервал до следующей.
+
+        `prices` — цена по каждой проверенной дате; None, если API не ответил.
+        `from_cache` — ни одна цена не запрашивалась у API: такая проверка не считается
+        подтверждением стабильности (но движение цены в ней учитывается).
+        """
+        if not self.adaptive:
+            cadence["interval"] = POLL_INTERVAL
+            return POLL_INTERVAL
+
+        days = [d for d in (days_until(date) for date in dates) if d is not None]
+        nearest = min(days) if days else None
+        base = self.base_interval(nearest)
+        # Близкие даты опрашиваются с постоянной частотой, отступаем только для дальних
+        ceiling = base if nearest is not None and nearest <= POLL_NEAR_DAYS else max(base, POLL_MAX_INTERVAL)
+
+        answered = {date: price for date, price in prices.items() if price is not None}
+        if not answered:
+            # Ошибка API — не считаем это ни стабильностью, ни движением цены
+            interval = min(max(cadence["interval"], base), ceiling)
+        else:
+            previous = cadence["prices"]
+            moved = any(
+                date not in previous or abs(price - previous[date]) > POLL_PRICE_CHANGE * max(previous[date], 1)
+                for date, price in answered.items()
+            )
+            cadence["prices"] = {**previous, **answered}
+            if moved and previous:
+                cadence["stable_checks"] = 0
+            elif not moved and not from_cache and base * POLL_BACKOFF ** cadence["stable_checks"] < ceiling:
+                cadence["stable_checks"] += 1
+            interval = min(ceiling, base * POLL_BACKOFF ** cadence["stable_checks"])
+
+        cadence["interval"] = interval
+        return interval
+
+
+poll_policy = PollPolicy()
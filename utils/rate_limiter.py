@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+class UpstreamThrottled(Exception):
+    """Внешний API ответил 429/5xx — запрос можно повторить позже."""
+
+    def __init__(self, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(f"upstream throttled (status={status}, retry_after={retry_after})")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def is_throttle_status(status: Optional[int]) -> bool:
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+
+def status_of_exception(exc: BaseException) -> Optional[int]:
+    """Пытается достать HTTP-статус из исключения клиента (httpx/aiohttp/SDK)."""
+    for obj in (exc, getattr(exc, "response", None)):
+        if obj is None:
+            continue
+        for attr in ("status_code", "status"):
+            value = getattr(obj, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def throttled_from_exception(exc: BaseException) -> Optional[UpstreamThrottled]:
+    """UpstreamThrottled, если исключение клиента означает 429/5xx, иначе None."""
+    status = status_of_exception(exc)
+    if not is_throttle_status(status):
+        return None
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+    except Exception:
+        retry_after = None
+    return UpstreamThrottled(status, retry_after)
+
+
+def parse_retry_after(value: Any) -> Optional[float]:
+    try:
+        if value is None or value == "":
+            return None
+        return max(0.0, float(value))
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    """Асинхронный token bucket с AIMD-подстройкой скорости.
+
+    Скорость пополнения начинается с `rate` токенов в секунду, ёмкость `capacity`
+    задаёт допустимый всплеск. При 429/5xx скорость умножается на `decrease`
+    (не ниже `min_rate`), после каждого успешного запроса растёт на `increase`
+    (не выше исходной `rate`).
+
+    Ожидающие обслуживаются по `priority` (меньше — раньше), при равном — в порядке прихода.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: Optional[float] = None,
+                 increase: Optional[float] = None, decrease: float = 0.5, name: str = ""):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.min_rate = float(min_rate) if min_rate is not None else self.max_rate / 20
+        self.increase = float(increase) if increase is not None else self.max_rate / 50
+        self.decrease = decrease
+        self.name = name
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = asyncio.Condition()
+        self._waiters: List[tuple] = []  # (priority, seq)
+        self._seq = itertools.count()
+
+    async def acquire(self, tokens: float = 1.0, priority: int = 0):
+        tokens = min(float(tokens), self.capacity)
+        entry = (priority, next(self._seq))
+        async with self._cond:
+            heapq.heappush(self._waiters, entry)
+            # Новый ожидающий может оказаться важнее того, кто сейчас ждёт токенов
+            self._cond.notify_all()
+            try:
+                while True:
+                    if self._waiters[0] != entry:
+                        await self._cond.wait()
+                        continue
+                    delay = await self._take(tokens)
+                    if delay <= 0:
+                        return
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    async def _take(self, tokens: float) -> float:
+        """Забирает токены; возвращает 0 или сколько секунд ждать до следующей попытки."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+
+# Общий для всех процессов bucket: состояние (tokens, ts) в hash, пауза по Retry-After — отдельный ключ.
+# Время берётся у Redis, чтобы расхождение часов процессов не влияло на пополнение.
+_SHARED_TAKE = """
+local pause = redis.call('pttl', KEYS[2])
+if pause > 0 then return pause end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local tokens = tonumber(ARGV[3])
+local t = redis.call('time')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local level = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+level = math.min(capacity, level + math.max(0, now - ts) * rate)
+local wait = 0
+if level >= tokens then
+    level = level - tokens
+else
+    wait = math.ceil((tokens - level) / rate * 1000)
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(level), 'ts', tostring(now))
+redis.call('pexpire', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return wait
+"""
+_SHARED_PAUSE = """
+if redis.call('pttl', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('set', KEYS[1], '1', 'px', ARGV[1])
+end
+return 1
+"""
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket, токены которого общие для всех процессов с тем же `name` (через Redis).
+
+    Лимит внешнего API действует на весь бот, а не на процесс: с RUN_MODE=worker
+    и N воркерами локальные bucket'ы пропустили бы N × rate. Порядок ожидающих
+    (priority) и AIMD-подстройка остаются локальными: процесс пополняет общий bucket
+    со своей текущей скоростью. Пауза по Retry-After тоже общая.
+    Без REDIS_URL или при недоступном Redis работает как обычный локальный TokenBucket.
+    """
+
+    # Сколько секунд после ошибки Redis обходиться локальными токенами
+    FALLBACK_SECONDS = 30.0
+
+    def __init__(self, rate: float, capacity: float, name: str, **kwargs):
+        super().__init__(rate, capacity, name=name, **kwargs)
+        self._key = f"ratelimit:{name}"
+        self._pause_key = f"ratelimit:{name}:pause"
+        self._redis_down_until = 0.0 if os.getenv("REDIS_URL") else float("inf")
+        self._pause_tasks = set()
+
+    async def _take(self, tokens: float) -> float:
+        if time.monotonic() < self._redis_down_until:
+            return await super()._take(tokens)
+        try:
+            from utils.redis_client import get_async_redis
+
+            wait_ms = await get_async_redis().eval(
+                _SHARED_TAKE, 2, self._key, self._pause_key, self.rate, self.capacity, tokens
+            )
+        except Exception as e:
+            print(f"Лимит {self.name}: Redis недоступен ({e}), временно считаем токены локально")
+            self._redis_down_until = time.monotonic() + self.FALLBACK_SECONDS
+            return await super()._take(tokens)
+        # Локальная пауза (Retry-After, полученный этим процессом) действует и без Redis
+        local_pause = self._paused_until - time.monotonic()
+        return max(int(wait_ms) / 1000, local_pause if local_pause > 0 else 0.0)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        super().on_throttle(retry_after)
+        if retry_after and time.monotonic() >= self._redis_down_until:
+            task = asyncio.create_task(self._share_pause(retry_after))
+            self._pause_tasks.add(task)
+            task.add_done_callback(self._pause_tasks.discard)
+
+    async def _share_pause(self, retry_after: float):
+        try:
+            from utils.redis_client import get_async_redis
+
+            await get_async_redis().eval(_SHARED_PAUSE, 1, self._pause_key, int(retry_after * 1000))
+        except Exception:
+            pass
+
+
+async def retry_with_backoff(fn: Callable[[], Awaitable[Any]], attempts: int = 3,
+                             base_delay: float = 1.0, max_delay: float = 30.0) -> Any:
+    """Повторяет `fn` при UpstreamThrottled с экспоненциальной задержкой и полным джиттером."""
+    for attempt in range(attempts):
+        try:
+            return await fn()
+        except UpstreamThrottled as e:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            if e.retry_after:
+                delay = max(delay, e.retry_after)
+            await asyncio.sleep(delay)
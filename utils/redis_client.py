@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 _redis_client = None  # type: Optional["redis.Redis"]
+_async_redis_client = None  # type: Optional["redis.asyncio.Redis"]
 
 
 def get_redis():
@@ -21,6 +22,20 @@ def get_redis():
     return _redis_client
 
 
+def get_async_redis():
+    """Асинхронный клиент (redis.asyncio) для вызовов из event loop."""
+    global _async_redis_client
+    if _async_redis_client is not None:
+        return _async_redis_client
+
+    import redis.asyncio as aioredis
+
+    url = os.getenv("REDIS_URL")
+    _async_redis_client = aioredis.from_url(url, decode_responses=True)
+
+    return _async_redis_client
+
+
 def close_redis():
     global _redis_client
     if _redis_client is not None:
@@ -31,3 +46,13 @@ def close_redis():
         _redis_client = None
 
 
+async def close_async_redis():
+    global _async_redis_client
+    if _async_redis_client is not None:
+        try:
+            # aclose() появился в redis 5.0.1, close() в новых версиях устарел
+            closer = getattr(_async_redis_client, "aclose", None) or _async_redis_client.close
+            await closer()
+        except Exception:
+            pass
+        _async_redis_client = None
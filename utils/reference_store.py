@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# Файл собирается командой `python -m utils.build_reference_db` (в Docker — при сборке образа)
+REFERENCE_DB_PATH = os.getenv(
+    "REFERENCE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "reference.sqlite"),
+)
+REFERENCE_MMAP_SIZE = int(os.getenv("REFERENCE_MMAP_SIZE", str(64 * 1024 * 1024)))
+
+_conn = None  # type: Optional[sqlite3.Connection]
+_lock = threading.Lock()
+_checked = False
+
+
+def _connect() -> Optional[sqlite3.Connection]:
+    """Соединение только для чтения; None, если файла нет (тогда работают словари)."""
+    global _conn, _checked
+    if _checked:
+        return _conn
+    with _lock:
+        if _checked:
+            return _conn
+        try:
+            if os.path.exists(REFERENCE_DB_PATH):
+                uri = f"file:{REFERENCE_DB_PATH}?mode=ro&immutable=1"
+                conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                # Страницы файла отображаются в память и делятся между процессами через page cache
+                conn.execute(f"PRAGMA mmap_size = {REFERENCE_MMAP_SIZE}")
+                conn.execute("SELECT 1 FROM airports LIMIT 1")
+                _conn = conn
+            else:
+                print(f"Справочник {REFERENCE_DB_PATH} не найден, используются словари из utils/*_icao.py")
+        except Exception as e:
+            print(f"Не удалось открыть справочник {REFERENCE_DB_PATH}: {e}")
+            _conn = None
+        _checked = True
+    return _conn
+
+
+def _query(sql: str, params: tuple = ()) -> list:
+    conn = _connect()
+    with _lock:
+        return conn.execute(sql, params).fetchall()
+
+
+def get_airport(code: str) -> Optional[Tuple[str, str]]:
+    """(city, name) по ICAO-коду аэропорта или None."""
+    return get_airports([code]).get(str(code).upper())
+
+
+def get_airline(code: str) -> Optional[Tuple[str, str]]:
+    """(name, country) по ICAO-коду авиакомпании или None."""
+    return get_airlines([code]).get(str(code).upper())
+
+
+def get_airports(codes: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+    """{code: (city, name)} для найденных кодов — один запрос к индексу."""
+    return _lookup("airports", "city, name", codes, _airport_dict)
+
+
+def get_airlines(codes: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+    """{code: (name, country)} для найденных кодов — один запрос к индексу."""
+    return _lookup("airlines", "name, country", codes, _airline_dict)
+
+
+def iter_airports() -> Iterator[Tuple[str, Tuple[str, str]]]:
+    """Все аэропорты парами (code, (city, name)) — для построения поисковых индексов."""
+    return _iterate("airports", "city, name", _airport_dict)
+
+
+def iter_airlines() -> Iterator[Tuple[str, Tuple[str, str]]]:
+    """Все авиакомпании парами (code, (name, country))."""
+    return _iterate("airlines", "name, country", _airline_dict)
+
+
+def reference_version() -> Optional[str]:
+    """Версия (хэш содержимого) собранного справочника или None без файла."""
+    if _connect() is None:
+        return None
+    rows = _query("SELECT value FROM meta WHERE key = 'version'")
+    return rows[0][0] if rows else None
+
+
+# SQLite ограничивает число параметров в запросе
+_CHUNK = 500
+
+
+def _lookup(table: str, columns: str, codes: Iterable[str], fallback) -> Dict[str, Tuple[str, str]]:
+    keys = list({str(c).upper() for c in codes if c})
+    if not keys:
+        return {}
+    if _connect() is None:
+        data = fallback()
+        return {c: data[c] for c in keys if c in data}
+    result: Dict[str, Tuple[str, str]] = {}
+    for start in range(0, len(keys), _CHUNK):
+        chunk = keys[start:start + _CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        rows = _query(f"SELECT code, {columns} FROM {table} WHERE code IN ({placeholders})", tuple(chunk))
+        for code, first, second in rows:
+            result[code] = (first, second)
+    return result
+
+
+def _iterate(table: str, columns: str, fallback) -> Iterator[Tuple[str, Tuple[str, str]]]:
+    if _connect() is None:
+        for code, value in fallback().items():
+            yield str(code).upper(), tuple(value or ("", ""))
+        return
+    for code, first, second in _query(f"SELECT code, {columns} FROM {table}"):
+        yield code, (first, second)
+
+
+def _airport_dict() -> dict:
+    from utils.airport_icao import airport_icao
+    return airport_icao
+
+
+def _airline_dict() -> dict:
+    from utils.airlines_icao import airlines_icao
+    return airlines_icao
+
+
+def close_reference_store():
+    global _conn, _checked
+    with _lock:
+        if _conn is not None:
+            try:
+                _conn.close()
+            except Exception:
+                pass
+        _conn = None
+        _checked = False
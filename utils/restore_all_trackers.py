@@ -1,26 +1,27 @@
-import asyncio
+import os
+import time
 
-from db_handlers.db_class import db
-from handlers.task import user_tasks, tracker_tasks
-from utils.track_flight import track_flight
+from utils.scheduler import scheduler
+from utils.tracker_state import tracker_states
 
+# Как часто (в трекерах) печатать прогресс восстановления
+RESTORE_PROGRESS_EVERY = int(os.getenv("RESTORE_PROGRESS_EVERY", "1000"))
 
-async def restore_all_trackers():
-    await db.connect()
-    active_trackers = await db.get_active_trackers()
-    for tracker in active_trackers:
-        telegram_id = tracker["telegram_id"]
-        if telegram_id not in user_tasks:
-            user_tasks[telegram_id] = []
-        task = asyncio.create_task(
-            track_flight(
-                telegram_id,
-                tracker["origin"],
-                tracker["destination"],
-                tracker["date"],
-                tracker["price_limit"],
-                tracker_id=tracker["tracker_id"]
-            )
-        )
-        user_tasks[telegram_id].append(task)
-        tracker_tasks[tracker["tracker_id"]] = task
\ No newline at end of file
+
+async def restore_all_trackers() -> int:
+    """Восстанавливает активные трекеры после рестарта.
+
+    Строки читаются из БД потоком; первая проверка каждого трекера назначается
+    в случайный момент интервала опроса, чтобы рестарт не давал всплеска запросов к API.
+    """
+    started = time.monotonic()
+    restored = 0
+    # Состояние трекеров читается из БД один раз, дальше опрос работает по памяти
+    async for tracker in tracker_states.load():
+        scheduler.add_staggered(tracker)
+        restored += 1
+        if restored % RESTORE_PROGRESS_EVERY == 0:
+            print(f"Восстановлено трекеров: {restored}")
+    print(f"Восстановлено трекеров: {restored} за {time.monotonic() - started:.1f} с, "
+          f"первые проверки распределены по {scheduler.interval:.0f} с")
+    return restored
@@ -0,0 +1,257 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+from typing import Dict, List, Optional, Set
+
+from utils.aviasales_api import batch_key, fetch_price_for_date
+from utils.poll_policy import POLL_INTERVAL, poll_policy
+from utils.track_flight import check_tracker
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "20"))
+# Как часто печатать распределение интервалов опроса; 0 — не печатать
+SCHEDULER_REPORT_INTERVAL = float(os.getenv("SCHEDULER_REPORT_INTERVAL", "600"))
+# 1 — печатать каждое изменение интервала опроса ключа (для воркеров, где нет «Мои отслеживания»)
+SCHEDULER_LOG_CADENCE = os.getenv("SCHEDULER_LOG_CADENCE", "0") == "1"
+
+
+def _price_of(flight: Optional[dict]) -> Optional[int]:
+    if not flight or flight.get("error"):
+        return None
+    try:
+        return int(flight.get("price"))
+    except Exception:
+        return None
+
+
+class TrackerScheduler:
+    """Единый планировщик опроса трекеров.
+
+    Вместо отдельной asyncio-задачи на каждый трекер держит очередь с приоритетом
+    по времени следующей проверки; её разбирает ограниченный пул воркеров.
+    Трекеры, которые обслуживает один запрос к API (тот же маршрут и дата,
+    а в пакетном режиме — тот же месяц), проверяются по одному ответу.
+    Интервал до следующей проверки ключа выбирает poll_policy.
+    """
+
+    def __init__(self, interval: float = POLL_INTERVAL, workers: int = SCHEDULER_WORKERS):
+        self.interval = interval
+        self.workers = max(1, workers)
+        self._heap: List[tuple] = []  # (due, seq, tracker_id)
+        self._trackers: Dict[int, dict] = {}
+        self._user_trackers: Dict[int, Set[int]] = {}
+        self._by_key: Dict[tuple, Set[int]] = {}
+        self._cadence: Dict[tuple, dict] = {}
+        self._seq = itertools.count()
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks.append(asyncio.create_task(self._dispatch()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._work()))
+        if SCHEDULER_REPORT_INTERVAL > 0:
+            self._tasks.append(asyncio.create_task(self._report_loop()))
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def add(self, tracker: dict, delay: float = 0.0):
+        """Ставит трекер в расписание; первая проверка — через `delay` секунд (по умолчанию сразу).
+
+        `tracker` — словарь вида get_active_trackers(): tracker_id, telegram_id,
+        origin, destination, date, price_limit.
+        """
+        tracker_id = tracker["tracker_id"]
+        self.remove(tracker_id)
+        record = dict(tracker)
+        record["_key"] = batch_key(record["origin"], record["destination"], record["date"])
+        self._trackers[tracker_id] = record
+        self._user_trackers.setdefault(record["telegram_id"], set()).add(tracker_id)
+        self._by_key.setdefault(record["_key"], set()).add(tracker_id)
+        if record["_key"] not in self._cadence:
+            self._cadence[record["_key"]] = poll_policy.new_cadence()
+        self._push(tracker_id, delay)
+
+    def add_staggered(self, tracker: dict):
+        """Как add, но первая проверка в случайный момент интервала опроса.
+
+        Для массовой загрузки (рестарт, переезд шардов): запросы к API
+        распределяются по интервалу, а не уходят все разом.
+        """
+        self.add(tracker, random.uniform(0, self.interval))
+
+    def remove(self, tracker_id: int) -> bool:
+        record = self._trackers.pop(tracker_id, None)
+        if record is None:
+            return False
+        user_ids = self._user_trackers.get(record["telegram_id"])
+        if user_ids is not None:
+            user_ids.discard(tracker_id)
+            if not user_ids:
+                self._user_trackers.pop(record["telegram_id"], None)
+        key_ids = self._by_key.get(record["_key"])
+        if key_ids is not None:
+            key_ids.discard(tracker_id)
+            if not key_ids:
+                self._by_key.pop(record["_key"], None)
+                self._cadence.pop(record["_key"], None)
+        return True
+
+    def remove_user(self, telegram_id: int) -> int:
+        """Снимает с расписания все трекеры пользователя, возвращает их количество."""
+        tracker_ids = list(self._user_trackers.get(telegram_id, ()))
+        for tracker_id in tracker_ids:
+            self.remove(tracker_id)
+        return len(tracker_ids)
+
+    def __len__(self) -> int:
+        return len(self._trackers)
+
+    def cadence(self, tracker_id: int) -> Optional[dict]:
+        """Текущий режим опроса трекера: интервал, проверок без движения цены, секунд до следующей."""
+        record = self._trackers.get(tracker_id)
+        if record is None:
+            return None
+        cadence = self._cadence.get(record["_key"]) or poll_policy.new_cadence()
+        next_in = record.get("_due", 0.0) - asyncio.get_running_loop().time()
+        return {
+            "interval": cadence["interval"],
+            "stable_checks": cadence["stable_checks"],
+            "next_check_in": max(0.0, next_in),
+        }
+
+    def cadence_summary(self) -> Dict[str, int]:
+        """Сколько ключей опрашивается с каким интервалом (для логов)."""
+        buckets = {"≤1 мин": 0, "≤5 мин": 0, "≤15 мин": 0, "≤1 ч": 0, ">1 ч": 0}
+        for cadence in self._cadence.values():
+            interval = cadence["interval"]
+            if interval <= 60:
+                buckets["≤1 мин"] += 1
+            elif interval <= 300:
+                buckets["≤5 мин"] += 1
+            elif interval <= 900:
+                buckets["≤15 мин"] += 1
+            elif interval <= 3600:
+                buckets["≤1 ч"] += 1
+            else:
+                buckets[">1 ч"] += 1
+        return buckets
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(SCHEDULER_REPORT_INTERVAL)
+            if self._cadence:
+                print(f"Опрос: трекеров {len(self._trackers)}, ключей {len(self._cadence)}, "
+                      f"интервалы {self.cadence_summary()}")
+
+    def _push(self, tracker_id: int, delay: float):
+        record = self._trackers.get(tracker_id)
+        if record is None:
+            return
+        seq = next(self._seq)
+        # Запоминаем актуальную запись в куче: устаревшие пропускаются при извлечении
+        record["_seq"] = seq
+        due = asyncio.get_running_loop().time() + max(0.0, delay)
+        record["_due"] = due
+        heapq.heappush(self._heap, (due, seq, tracker_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            due, seq, tracker_id = self._heap[0]
+            delay = due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            record = self._trackers.get(tracker_id)
+            if record is None or record.get("_seq") != seq:
+                continue
+            # Очередь ограничена числом воркеров — это и есть глобальный контроль темпа
+            await self._queue.put((tracker_id, seq))
+
+    async def _work(self):
+        while True:
+            tracker_id, seq = await self._queue.get()
+            try:
+                record = self._trackers.get(tracker_id)
+                # Трекер могли снять или уже проверить вместе с соседями по маршруту
+                if record is None or record.get("_busy") or record.get("_seq") != seq:
+                    continue
+                # Все свободные подписчики того же ключа проверяются по одному ответу API;
+                # в пакетном режиме остальные даты месяца берутся из кэша без новых запросов
+                records = [
+                    self._trackers[tid] for tid in self._by_key.get(record["_key"], ())
+                    if not self._trackers[tid].get("_busy")
+                ]
+                for r in records:
+                    r["_busy"] = True
+                cadence = self._cadence.get(record["_key"])
+                # Кэш цен не должен отвечать на плановую проверку нашим же прошлым ответом:
+                # допустим только ответ, полученный (кем угодно) за последние полинтервала
+                max_age = cadence["interval"] / 2 if cadence is not None else None
+                flights = {}
+                fetched = False
+                for date in sorted({r["date"] for r in records}):
+                    try:
+                        flights[date], cached = await fetch_price_for_date(
+                            record["origin"], record["destination"], date, max_age=max_age
+                        )
+                        fetched = fetched or not cached
+                    except Exception as e:
+                        print(f"Ошибка запроса цены {record['_key']} {date}: {e}")
+                        flights[date] = None
+                interval = self.interval
+                if cadence is not None:
+                    prices = {date: _price_of(flight) for date, flight in flights.items()}
+                    previous = cadence["interval"]
+                    interval = poll_policy.update(cadence, flights.keys(), prices, from_cache=not fetched)
+                    if SCHEDULER_LOG_CADENCE and interval != previous:
+                        print(f"Интервал опроса {record['_key']}: {previous:.0f} → {interval:.0f} с "
+                              f"(проверок без изменения цены: {cadence['stable_checks']})")
+                await self._check(records, flights, interval)
+            finally:
+                self._queue.task_done()
+
+    async def _check(self, records: List[dict], flights: Dict[str, Optional[dict]], interval: float):
+        for record in records:
+            record["_busy"] = True
+
+        async def _one(record: dict):
+            try:
+                await check_tracker(record, flights.get(record["date"]))
+            except Exception as e:
+                print(f"Ошибка проверки трекера {record['tracker_id']}: {e}")
+            finally:
+                record["_busy"] = False
+                self._push(record["tracker_id"], interval)
+
+        await asyncio.gather(*(_one(r) for r in records))
+
+
+scheduler = TrackerScheduler()
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+
+from db_handlers.db_class import db
+from utils.aviasales_api import batch_key
+from utils.scheduler import scheduler
+from utils.tracker_state import tracker_states
+
+# Режим процесса: all — всё в одном процессе (как раньше), bot — только обработка
+# апдейтов Telegram, worker — только опрос цен по своим шардам
+RUN_MODE = os.getenv("RUN_MODE", "all").lower()
+# Число виртуальных шардов; меняется только вместе с остановкой всех воркеров
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "64"))
+WORKER_HEARTBEAT = float(os.getenv("WORKER_HEARTBEAT", "5"))
+# Воркер без heartbeat дольше этого считается упавшим, его аренды шардов истекают
+WORKER_TTL = float(os.getenv("WORKER_TTL", "15"))
+# Полная сверка с БД — страховка на случай потерянных событий pub/sub
+TRACKER_RECONCILE_INTERVAL = float(os.getenv("TRACKER_RECONCILE_INTERVAL", "60"))
+
+WORKERS_KEY = "workers:alive"
+EVENTS_CHANNEL = "trackers:events"
+
+# Продление/снятие аренды только своим владельцем
+_RENEW_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _hash64(value: str) -> int:
+    # Не hash(): он рандомизирован по процессам
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shard_of(origin: str, destination: str, date: str) -> int:
+    """Виртуальный шард трекера по ключу запроса к API.
+
+    Трекеры, которые обслуживает один запрос (маршрут и дата, в пакетном режиме — месяц),
+    попадают в один шард, поэтому объединение запросов в планировщике сохраняется.
+    """
+    key = ":".join(str(part) for part in batch_key(origin, destination, date))
+    return _hash64(key) % SHARD_COUNT
+
+
+def shard_owner(shard: int, workers: Iterable[str]) -> Optional[str]:
+    """Владелец шарда по rendezvous-хэшированию: при уходе воркера переезжают только его шарды."""
+    return max(workers, key=lambda worker: _hash64(f"{worker}#{shard}"), default=None)
+
+
+def _lease_key(shard: int) -> str:
+    return f"shard:lease:{shard}"
+
+
+class ShardCoordinator:
+    """Распределяет шарды трекеров между процессами в режиме worker.
+
+    - Heartbeat: воркер раз в WORKER_HEARTBEAT секунд продлевает себе срок жизни
+      в sorted set `workers:alive` (score — момент истечения) и читает список живых.
+    - Аренды: шард опрашивает только держатель ключа `shard:lease:<n>` (SET NX PX);
+      аренда продлевается с heartbeat и истекает через WORKER_TTL, если воркер упал.
+    - Новые и отключённые трекеры приходят событиями из бота (pub/sub `trackers:events`),
+      раз в TRACKER_RECONCILE_INTERVAL состояние сверяется с БД.
+    """
+
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.owned: Set[int] = set()
+        self.alive: List[str] = []
+        self._tracker_shard: Dict[int, int] = {}
+        self._rebalance_lock = asyncio.Lock()
+
+    async def run(self):
+        """Работает до отмены; при выходе отпускает аренды и снимается с учёта."""
+        from utils.redis_client import get_async_redis
+        r = get_async_redis()
+        pubsub = r.pubsub()
+        # Подписка до первой загрузки, чтобы не пропустить трекеры, добавленные в это время
+        await pubsub.subscribe(EVENTS_CHANNEL)
+        try:
+            await self._tick(r)
+            await asyncio.gather(
+                self._heartbeat_loop(r),
+                self._events_loop(pubsub),
+                self._reconcile_loop(),
+            )
+        finally:
+            try:
+                await pubsub.unsubscribe(EVENTS_CHANNEL)
+                closer = getattr(pubsub, "aclose", None) or pubsub.close
+                await closer()
+            except Exception:
+                pass
+            await self._shutdown(r)
+
+    async def _heartbeat_loop(self, r):
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT)
+            try:
+                await self._tick(r)
+            except Exception as e:
+                print(f"Ошибка heartbeat воркера {self.worker_id}: {e}")
+
+    async def _tick(self, r):
+        now = time.time()
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.zadd(WORKERS_KEY, {self.worker_id: now + WORKER_TTL})
+            pipe.zremrangebyscore(WORKERS_KEY, "-inf", now)
+            pipe.zrange(WORKERS_KEY, 0, -1)
+            results = await pipe.execute()
+        self.alive = sorted(results[-1])
+        await self._rebalance(r)
+
+    async def _rebalance(self, r):
+        async with self._rebalance_lock:
+            desired = {s for s in range(SHARD_COUNT) if shard_owner(s, self.alive) == self.worker_id}
+            ttl_ms = int(WORKER_TTL * 1000)
+            kept = sorted(self.owned & desired)
+            lost = sorted(self.owned - desired)
+            wanted = sorted(desired - self.owned)
+
+            async with r.pipeline(transaction=False) as pipe:
+                for shard in kept:
+                    pipe.eval(_RENEW_LEASE, 1, _lease_key(shard), self.worker_id, ttl_ms)
+                for shard in lost:
+                    pipe.eval(_RELEASE_LEASE, 1, _lease_key(shard), self.worker_id)
+                # Шард прежнего владельца освободится, когда тот увидит новый состав
+                # или когда истечёт его аренда
+                for shard in wanted:
+                    pipe.set(_lease_key(shard), self.worker_id, nx=True, px=ttl_ms)
+                results = await pipe.execute() if (kept or lost or wanted) else []
+
+            renewed = results[:len(kept)]
+            acquired = results[len(kept) + len(lost):]
+            # Аренду, которую не удалось продлить (долгая пауза процесса), считаем потерянной
+            dropped = set(lost) | {shard for shard, ok in zip(kept, renewed) if not ok}
+            gained = {shard for shard, ok in zip(wanted, acquired) if ok}
+
+            if dropped:
+                self.owned -= dropped
+                self._drop_shards(dropped)
+            if gained:
+                self.owned |= gained
+                await self._load_shards(gained)
+            if dropped or gained:
+                print(f"Воркер {self.worker_id}: шардов {len(self.owned)}/{SHARD_COUNT}, "
+                      f"трекеров {len(self._tracker_shard)}, живых воркеров {len(self.alive)}")
+
+    async def _load_shards(self, shards: Set[int]):
+        async for tracker in db.iter_active_trackers():
+            shard = shard_of(tracker["origin"], tracker["destination"], tracker["date"])
+            if shard in shards and tracker["tracker_id"] not in self._tracker_shard:
+                self._track(tracker, shard, staggered=True)
+
+    def _drop_shards(self, shards: Set[int]):
+        for tracker_id, shard in list(self._tracker_shard.items()):
+            if shard in shards:
+                self._untrack(tracker_id)
+
+    def _track(self, tracker: dict, shard: int, staggered: bool = False):
+        self._tracker_shard[tracker["tracker_id"]] = shard
+        tracker_states.put(tracker)
+        # Шарды, полученные при старте или от упавшего воркера, не должны опрашиваться разом
+        if staggered:
+            scheduler.add_staggered(tracker)
+        else:
+            scheduler.add(tracker)
+
+    def _untrack(self, tracker_id: int):
+        self._tracker_shard.pop(tracker_id, None)
+        tracker_states.forget(tracker_id)
+        scheduler.remove(tracker_id)
+
+    async def _events_loop(self, pubsub):
+        async for message in pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            try:
+                self._apply_event(json.loads(message["data"]))
+            except Exception as e:
+                print(f"Некорректное событие трекеров: {e}")
+
+    def _apply_event(self, event: dict):
+        op = event.get("op")
+        if op == "add":
+            tracker = event["tracker"]
+            shard = shard_of(tracker["origin"], tracker["destination"], tracker["date"])
+            if shard in self.owned and tracker["tracker_id"] not in self._tracker_shard:
+                self._track(tracker, shard)
+        elif op == "remove":
+            self._untrack(int(event["tracker_id"]))
+        elif op == "remove_user":
+            for tracker_id in tracker_states.forget_user(int(event["telegram_id"])):
+                self._untrack(tracker_id)
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(TRACKER_RECONCILE_INTERVAL)
+            try:
+                await self._reconcile()
+            except Exception as e:
+                print(f"Ошибка сверки трекеров с БД: {e}")
+
+    async def _reconcile(self):
+        async with self._rebalance_lock:
+            active = set()
+            async for tracker in db.iter_active_trackers():
+                shard = shard_of(tracker["origin"], tracker["destination"], tracker["date"])
+                if shard not in self.owned:
+                    continue
+                active.add(tracker["tracker_id"])
+                if tracker["tracker_id"] not in self._tracker_shard:
+                    self._track(tracker, shard, staggered=True)
+            for tracker_id in list(self._tracker_shard):
+                if tracker_id not in active:
+                    self._untrack(tracker_id)
+
+    async def _shutdown(self, r):
+        try:
+            async with r.pipeline(transaction=False) as pipe:
+                for shard in self.owned:
+                    pipe.eval(_RELEASE_LEASE, 1, _lease_key(shard), self.worker_id)
+                pipe.zrem(WORKERS_KEY, self.worker_id)
+                await pipe.execute()
+        except Exception:
+            # Аренды истекут сами через WORKER_TTL
+            pass
+        self._drop_shards(set(self.owned))
+        self.owned.clear()
+
+
+async def _publish(event: dict):
+    try:
+        from utils.redis_client import get_async_redis
+        await get_async_redis().publish(EVENTS_CHANNEL, json.dumps(event, ensure_ascii=False, separators=(",", ":")))
+    except Exception as e:
+        # Воркеры подхватят изменение при сверке с БД
+        print(f"Не удалось отправить событие трекеров: {e}")
+
+
+async def start_tracking(tracker: dict):
+    """Ставит новый трекер на опрос: в этом процессе (all) или воркеру-владельцу шарда (bot)."""
+    if RUN_MODE == "bot":
+        await _publish({"op": "add", "tracker": tracker})
+        return
+    tracker_states.put(tracker)
+    scheduler.add(tracker)
+
+
+async def stop_tracking(tracker_id: int):
+    await tracker_states.deactivate(tracker_id)
+    scheduler.remove(tracker_id)
+    if RUN_MODE == "bot":
+        await _publish({"op": "remove", "tracker_id": tracker_id})
+
+
+async def stop_user_tracking(telegram_id: int, user_id: int) -> int:
+    """Отключает все трекеры пользователя, возвращает, сколько было активных."""
+    count = await db.count_active_trackers(user_id)
+    await tracker_states.deactivate_user(telegram_id, user_id)
+    scheduler.remove_user(telegram_id)
+    if RUN_MODE == "bot":
+        await _publish({"op": "remove_user", "telegram_id": telegram_id})
+    return count
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один запрос.
+
+    Пока запрос по ключу выполняется, остальные вызовы ждут его результат.
+    Результаты не запоминаются (для этого есть TTLCache), исключения тоже —
+    следующий вызов повторит запрос.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.fetches = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._run(key, fn))
+            self._inflight[key] = fut
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(fut)
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "fetches": self.fetches, "inflight": len(self._inflight)}
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.fetches += 1
+        try:
+            return await fn()
+        finally:
+            self._inflight.pop(key, None)
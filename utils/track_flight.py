@@ -1,65 +1,50 @@
-import asyncio
 from typing import Optional
-from utils.aviasales_api import get_price_for_date, CURRENCY
-from utils.airport_codes import get_airport_name
-from create_bot import bot
-from db_handlers.db_class import db
-from utils.validators import format_iso_datetime_to_user, format_price, format_iso_date_to_user
+from utils.alert_digest import alert_digest
+from utils.tracker_state import tracker_states
 
 
-async def track_flight(telegram_id: int, origin: str, destination: str, date: str,
-                       price_limit: int, tracker_id: Optional[int] = None, initial_flight: dict = None):
-    first = True
-    while True:
-        if first and initial_flight:
-            flight = initial_flight
-            first = False
-        else:
-            flight = await get_price_for_date(origin, destination, date)
-        if flight:
-            price = flight.get("price", 0)
-            try:
-                price_int = int(price)
-            except Exception:
-                price_int = 0
+async def check_tracker(tracker: dict, flight: Optional[dict] = None):
+    """Одна проверка трекера по уже полученному ответу API; при необходимости шлёт уведомление.
 
-            # получаем последнюю отправленную цену по трекеру (если id известен)
-            last_sent = None
-            if tracker_id is not None:
-                try:
-                    last_sent = await db.get_last_sent_price(tracker_id)
-                except Exception:
-                    last_sent = None
+    Один и тот же `flight` может проверяться сразу для всех трекеров с тем же маршрутом и датой.
+    Порог и последняя отправленная цена берутся из tracker_states — без обращений к БД.
+    Уведомление уходит через alert_digest.
+    """
+    telegram_id = tracker["telegram_id"]
+    origin = tracker["origin"]
+    destination = tracker["destination"]
+    date = tracker["date"]
+    tracker_id = tracker.get("tracker_id")
+    state = tracker_states.get(tracker_id) if tracker_id is not None else None
+    if state is None or not state["active"]:
+        return
+    price_limit = state["price_limit"]
 
-            should_notify = False
-            if price_int < price_limit:
-                if last_sent is None or price_int < int(last_sent):
-                    should_notify = True
+    if not flight or flight.get("error"):
+        return
 
-            if should_notify:
-                airline = flight.get("airline", "").upper()
-                departure_iso = flight.get("departure_at", "")
-                departure = format_iso_datetime_to_user(departure_iso)
-                link = flight.get("link", "")
-                price_str = format_price(price_int)
-                
-                user_date = format_iso_date_to_user(date)
-                message_text = (
-                    f"✈️ <b>{get_airport_name(origin)}</b> → <b>{get_airport_name(destination)}</b>\n"
-                    f"📅 Дата: <b>{user_date}</b>\n"
-                    f"Цена: <b>{price_str} {CURRENCY.upper()}</b>\n"
-                    f"Авиакомпания: <b>{airline}</b>\n"
-                    f"Вылет: {departure}\n"
-                    f"<a href='https://www.aviasales.ru{link}'>🔗 Купить билет</a>"
-                )
-                try:
-                    await bot.send_message(telegram_id, message_text)
-                    if tracker_id is not None:
-                        try:
-                            await db.update_last_sent_price(tracker_id, price_int)
-                        except Exception:
-                            pass
-                except Exception as e:
-                    print(f"Ошибка Telegram: {e}")
+    price = flight.get("price", 0)
+    try:
+        price_int = int(price)
+    except Exception:
+        price_int = 0
 
-        await asyncio.sleep(100)
+    last_sent = state["last_sent_price"]
+
+    should_notify = False
+    if price_int < price_limit:
+        if last_sent is None or price_int < int(last_sent):
+            should_notify = True
+
+    if should_notify:
+        # Уведомления пользователя за короткое окно уходят одной сводкой
+        await alert_digest.add(telegram_id, {
+            "tracker_id": tracker_id,
+            "origin": origin,
+            "destination": destination,
+            "date": date,
+            "price": price_int,
+            "airline": flight.get("airline", "").upper(),
+            "departure_at": flight.get("departure_at", ""),
+            "link": flight.get("link", ""),
+        })
@@ -0,0 +1,84 @@
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from db_handlers.db_class import db
+
+
+class TrackerStateTable:
+    """Состояние активных трекеров в памяти процесса.
+
+    Загружается из БД один раз при старте (load) и дальше считается источником истины
+    для опроса: проверка цены читает порог и последнюю отправленную цену отсюда,
+    без запросов к SQLite. Любое изменение сначала применяется здесь, затем пишется
+    в БД (сквозная запись через групповой коммит Database).
+    """
+
+    def __init__(self):
+        self._states: Dict[int, dict] = {}
+        self._user_trackers: Dict[int, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    async def load(self) -> AsyncIterator[dict]:
+        """Читает активные трекеры из БД потоком, регистрирует и отдаёт их по одному."""
+        async for tracker in db.iter_active_trackers():
+            self.put(tracker)
+            yield tracker
+
+    def put(self, tracker: dict) -> dict:
+        """Регистрирует трекер (tracker_id, telegram_id, price_limit, last_sent_price)."""
+        tracker_id = tracker["tracker_id"]
+        state = {
+            "tracker_id": tracker_id,
+            "telegram_id": tracker["telegram_id"],
+            "price_limit": int(tracker["price_limit"]),
+            "last_sent_price": tracker.get("last_sent_price"),
+            "active": True,
+        }
+        self._states[tracker_id] = state
+        self._user_trackers.setdefault(state["telegram_id"], set()).add(tracker_id)
+        return state
+
+    def get(self, tracker_id: int) -> Optional[dict]:
+        return self._states.get(tracker_id)
+
+    async def record_sent(self, tracker_id: int, price: int):
+        """Запоминает цену, о которой пользователь уже уведомлён."""
+        state = self._states.get(tracker_id)
+        if state is not None:
+            state["last_sent_price"] = int(price)
+        await db.update_last_sent_price(tracker_id, price)
+
+    def ids(self) -> List[int]:
+        return list(self._states)
+
+    async def deactivate(self, tracker_id: int):
+        self.forget(tracker_id)
+        await db.deactivate_tracker(tracker_id)
+
+    async def deactivate_user(self, telegram_id: int, user_id: int):
+        """Отключает все трекеры пользователя (user_id — id в таблице users)."""
+        self.forget_user(telegram_id)
+        await db.deactivate_all_user_trackers(user_id)
+
+    def forget_user(self, telegram_id: int) -> List[int]:
+        tracker_ids = list(self._user_trackers.get(telegram_id, ()))
+        for tracker_id in tracker_ids:
+            self.forget(tracker_id)
+        return tracker_ids
+
+    def forget(self, tracker_id: int):
+        """Убирает трекер только из памяти процесса (БД не трогает)."""
+        state = self._states.pop(tracker_id, None)
+        if state is None:
+            return
+        # Проверка, которая уже идёт по этому трекеру, увидит флаг и не пришлёт уведомление
+        state["active"] = False
+        user_ids = self._user_trackers.get(state["telegram_id"])
+        if user_ids is not None:
+            user_ids.discard(tracker_id)
+            if not user_ids:
+                self._user_trackers.pop(state["telegram_id"], None)
+
+
+tracker_states = TrackerStateTable()
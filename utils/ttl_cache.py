@@ -0,0 +1,144 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """LRU-кэш в памяти процесса со сроком жизни записей и лимитом по объёму.
+
+    - `ttl` — сколько секунд запись считается свежей;
+    - `stale_ttl` — сколько ещё секунд после этого её можно отдать как устаревшую
+      (для режима stale-while-revalidate);
+    - `max_entries` / `max_bytes` — лимиты; при превышении вытесняются давно не читанные записи.
+      Размер записи оценивается по длине её JSON-представления.
+    - `redis_prefix` — если задан, записи дублируются в Redis (redis.asyncio),
+      чтобы кэш разделяли несколько процессов бота.
+
+    Срок свежести можно задать и для отдельной записи: set(key, value, ttl=...).
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0.0, max_entries: int = 10000,
+                 max_bytes: Optional[int] = None, redis_prefix: Optional[str] = None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.redis_prefix = redis_prefix
+        # key -> (stored_at, value, size, ttl)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._data), "bytes": self._bytes}
+
+    async def get_entry(self, key: Hashable) -> Optional[Tuple[Any, float, float]]:
+        """Возвращает (value, age, ttl) или None, если записи нет или она старше ttl + stale_ttl."""
+        now = time.time()
+        item = self._data.get(key)
+        if item is not None:
+            stored_at, value, _, ttl = item
+            age = now - stored_at
+            if age < ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self._count(age < ttl)
+                return value, age, ttl
+            self._drop(key)
+
+        if self.redis_prefix:
+            item = await self._redis_get(key)
+            if item is not None:
+                stored_at, value, ttl = item
+                age = now - stored_at
+                if age < ttl + self.stale_ttl:
+                    self._store(key, value, stored_at, ttl)
+                    self._count(age < ttl)
+                    return value, age, ttl
+        self._count(False)
+        return None
+
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        """Только свежие значения."""
+        entry = await self.get_entry(key)
+        if entry is None or entry[1] >= entry[2]:
+            return default
+        return entry[0]
+
+    async def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        stored_at = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        self._store(key, value, stored_at, ttl)
+        if self.redis_prefix:
+            await self._redis_set(key, value, stored_at, ttl)
+
+    def delete(self, key: Hashable):
+        self._drop(key)
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def _count(self, fresh: bool):
+        if fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _store(self, key: Hashable, value: Any, stored_at: float, ttl: float):
+        self._drop(key)
+        size = self._estimate_size(key, value)
+        self._data[key] = (stored_at, value, size, ttl)
+        self._bytes += size
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+
+    def _drop(self, key: Hashable):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    @staticmethod
+    def _estimate_size(key: Hashable, value: Any) -> int:
+        try:
+            return len(json.dumps(value, ensure_ascii=False, default=str)) + len(str(key))
+        except Exception:
+            return 256
+
+    def _redis_key(self, key: Hashable) -> str:
+        if isinstance(key, tuple):
+            key = ":".join(str(part) for part in key)
+        return f"{self.redis_prefix}:{key}"
+
+    async def _redis_get(self, key: Hashable) -> Optional[Tuple[float, Any, float]]:
+        try:
+            from utils.redis_client import get_async_redis
+            raw = await get_async_redis().get(self._redis_key(key))
+            if not raw:
+                return None
+            payload = json.loads(raw)
+            return float(payload["t"]), payload["v"], float(payload.get("ttl", self.ttl))
+        except Exception:
+            # Redis недоступен — работаем только с локальным кэшем
+            return None
+
+    async def _redis_set(self, key: Hashable, value: Any, stored_at: float, ttl: float):
+        try:
+            from utils.redis_client import get_async_redis
+            payload = json.dumps({"t": stored_at, "v": value, "ttl": ttl}, ensure_ascii=False, separators=(",", ":"))
+            expire = max(1, int(ttl + self.stale_ttl))
+            await get_async_redis().set(self._redis_key(key), payload, ex=expire)
+        except Exception:
+            pass
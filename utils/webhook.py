@@ -0,0 +1,137 @@
+import asyncio
+import hmac
+import os
+import signal
+from typing import Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+# polling — long polling (по умолчанию), webhook — приём апдейтов HTTP-сервером
+UPDATES_MODE = os.getenv("UPDATES_MODE", "polling").lower()
+# Публичный https-адрес, на который Telegram шлёт апдейты (без пути), напр. https://bot.example.com
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Обязателен: без него любой, кто достучится до порта, может слать апдейты от имени пользователей
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько апдейтов обрабатывается одновременно; сверх этого запрос ждёт свободного слота
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+# Сколько секунд при остановке ждать уже принятые апдейты
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Принимает апдейты Telegram по HTTP и передаёт их в Dispatcher.
+
+    - Запрос без верного секрета (заголовок X-Telegram-Bot-Api-Secret-Token) отклоняется;
+      без секрета сервер не создаётся.
+    - Ответ 200 отдаётся сразу после постановки апдейта в обработку, но не раньше,
+      чем освободится один из `max_in_flight` слотов: при перегрузке Telegram
+      сам снижает темп доставки.
+    - drain() перестаёт принимать новые апдейты (503 — Telegram повторит их позже)
+      и дожидается уже принятых.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str = WEBHOOK_SECRET,
+                 max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT, path: str = WEBHOOK_PATH):
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET не задан: webhook без секрета принимал бы поддельные апдейты")
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._tasks: Set[asyncio.Task] = set()
+        self._accepting = True
+        self.stats = {"received": 0, "processed": 0, "failed": 0, "rejected": 0}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        app.router.add_get("/healthz", self._health)
+        return app
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.json_response({"accepting": self._accepting, "in_flight": self.in_flight, **self.stats})
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.stats["rejected"] += 1
+            return web.Response(status=401)
+        if not self._accepting:
+            return web.Response(status=503)
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            self.stats["rejected"] += 1
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        self.stats["received"] += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+            self.stats["processed"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        self._accepting = False
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            print(f"Не дождались {len(pending)} апдейтов за {timeout} с — отменяем")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Поднимает HTTP-сервер и работает до SIGINT/SIGTERM, затем дожидается принятых апдейтов."""
+    server = WebhookServer(dp, bot)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    print(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=min(100, max(1, WEBHOOK_MAX_IN_FLIGHT)),
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    await dp.emit_startup(bot=bot)
+    try:
+        await stop.wait()
+    finally:
+        await server.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)